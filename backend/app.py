@@ -1,76 +1,417 @@
-from fastapi import FastAPI, HTTPException
-import pandas as pd
-import requests
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from datetime import date, datetime
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+import asyncio
+import httpx
 from dotenv import load_dotenv
 import os
-from backend.database import create_table_if_not_exists, save_to_db, delete, read, update, download
+from backend.database import create_table_if_not_exists, save_to_db, save_many_to_db, delete, delete_many, read, update, update_many, download, read_analytics, shape_rows, READ_SHAPES, WEATHER_PARTITIONING, popular_locations, open_pool, close_pool, pool_stats, data_version, make_etag, etag_matches, export_cache_stats
+from backend.cache import TTLCache
+from backend.upstream import weather_client
+from backend.write_behind import WriteBehindQueue
+from backend.prefetch import PrefetchScheduler
+from backend import changes, encoding, youtube
+from backend import metrics
+from backend.partitions import PARTITION_MAINTENANCE_INTERVAL, maintain as maintain_partitions
 
 load_dotenv()
 API_KEY = os.getenv("WEATHER_API_KEY")
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "60"))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1024"))
+WEATHER_BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", "10"))
+WEATHER_BATCH_MAX_SIZE = int(os.getenv("WEATHER_BATCH_MAX_SIZE", "500"))
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_MAX_SIZE = int(os.getenv("WRITE_BEHIND_MAX_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1"))
+WRITE_BEHIND_PUT_TIMEOUT = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "1"))
+WRITE_BEHIND_RETRY_DELAY = float(os.getenv("WRITE_BEHIND_RETRY_DELAY", "0.5"))
+WRITE_BEHIND_MAX_RETRY_DELAY = float(os.getenv("WRITE_BEHIND_MAX_RETRY_DELAY", "30"))
+WRITE_BEHIND_STOP_TIMEOUT = float(os.getenv("WRITE_BEHIND_STOP_TIMEOUT", "30"))
+PREFETCH = os.getenv("PREFETCH", "false").lower() in ("1", "true", "yes")
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", "200"))
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "10"))
+PREFETCH_LEAD = float(os.getenv("PREFETCH_LEAD", "15"))
+PREFETCH_RATE = float(os.getenv("PREFETCH_RATE", "5"))
+PREFETCH_MIN_SCORE = float(os.getenv("PREFETCH_MIN_SCORE", "0.5"))
+PREFETCH_HISTORY_DAYS = int(os.getenv("PREFETCH_HISTORY_DAYS", "7"))
 
-app = FastAPI()
+weather_cache = TTLCache(WEATHER_CACHE_TTL, WEATHER_CACHE_SIZE)
+write_queue = WriteBehindQueue(
+    save_many_to_db,
+    WRITE_BEHIND_MAX_SIZE,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_INTERVAL,
+    WRITE_BEHIND_PUT_TIMEOUT,
+    WRITE_BEHIND_RETRY_DELAY,
+    WRITE_BEHIND_MAX_RETRY_DELAY,
+    WRITE_BEHIND_STOP_TIMEOUT,
+)
+prefetcher = PrefetchScheduler(
+    weather_cache,
+    lambda location: fetch_weather(location),
+    popular_locations,
+    PREFETCH_TOP_N,
+    PREFETCH_INTERVAL,
+    PREFETCH_LEAD,
+    PREFETCH_RATE,
+    min_score=PREFETCH_MIN_SCORE,
+    history_days=PREFETCH_HISTORY_DAYS,
+)
 
-BASE_URL = "https://api.weatherapi.com/v1/current.json"
+metrics.register_collector("db_pool", pool_stats)
+metrics.register_collector("cache", weather_cache.stats)
+metrics.register_collector("write_queue", write_queue.stats)
+metrics.register_collector("youtube", youtube.stats)
+metrics.register_collector("prefetch", prefetcher.stats)
+metrics.register_collector("export_cache", export_cache_stats)
+metrics.register_collector("change_feed", changes.listener.stats)
+
+
+async def run_partition_maintenance():
+    while True:
+        await run_in_threadpool(maintain_partitions)
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+
+def prepare_database():
+    """
+    Open the pool's warm connections and create or upgrade the schema once per worker.
+    """
+    try:
+        open_pool()
+        create_table_if_not_exists()
+        youtube.create_youtube_tables()
+    except Exception as e:
+        metrics.record_error(e, "prepare_database")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(prepare_database)
+    await weather_client.start()
+    await youtube.youtube_client.start()
+    await changes.listener.start()
+    pruning = asyncio.create_task(changes.run_pruning())
+    if WRITE_BEHIND:
+        await write_queue.start()
+    maintenance = None
+    if WEATHER_PARTITIONING:
+        maintenance = asyncio.create_task(run_partition_maintenance())
+    if PREFETCH and WEATHER_CACHE_TTL > 0:
+        await prefetcher.start()
+    yield
+    pruning.cancel()
+    await changes.listener.stop()
+    await prefetcher.stop()
+    if maintenance is not None:
+        maintenance.cancel()
+    await write_queue.stop()
+    await weather_client.close()
+    await youtube.youtube_client.close()
+    close_pool()
+
+
+class TimedJSONResponse(JSONResponse):
+    def render(self, content):
+        with metrics.timed("serialization"):
+            return super().render(content)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response encoded with `backend.encoding.dumps`, for endpoints that hand it
+    rows directly instead of going through FastAPI's generic encoder.
+    """
+
+    def render(self, content):
+        with metrics.timed("serialization"):
+            return encoding.dumps(content)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
+
+if metrics.METRICS_ENABLED:
+    app.middleware("http")(metrics.track_request)
+
+BASE_URL = os.getenv("WEATHER_API_URL", "https://api.weatherapi.com/v1/current.json")
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Weather API"}
 
-@app.get("/get_weather/")
-def get_weather(location: str):
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
     """
-    Fetch weather data for a given location.
+    Expose request, stage and error metrics in Prometheus text format.
     """
-    url = f"{BASE_URL}?key={API_KEY}&q={location}&aqi=no"
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-    try:
-        response = requests.get(url) 
-        response.raise_for_status()
+@app.get("/pool_stats/")
+def get_pool_stats():
+    """
+    Report database connection pool usage (in use, idle, checkout wait times).
+    """
+    return pool_stats()
+
+@app.get("/cache_stats/")
+def get_cache_stats():
+    """
+    Report weather cache hit/miss/eviction counters.
+    """
+    return weather_cache.stats()
+
+@app.get("/prefetch_stats/")
+def get_prefetch_stats():
+    """
+    Report prefetch scheduler activity (tracked locations, refreshes, failures).
+    """
+    return prefetcher.stats()
+
+@app.get("/export_cache_stats/")
+def get_export_cache_stats():
+    """
+    Report export cache usage (entries, bytes, hits, misses).
+    """
+    return export_cache_stats()
+
+@app.get("/change_feed_stats/")
+def get_change_feed_stats():
+    """
+    Report change feed listener state, subscribers and events sent.
+    """
+    return changes.listener.stats()
+
+@app.get("/write_queue_stats/")
+def get_write_queue_stats():
+    """
+    Report write-behind queue depth and flush latency.
+    """
+    return write_queue.stats()
+
+def normalize_location(location):
+    return " ".join(location.split()).lower()
 
-        weather_data = response.json()
+async def fetch_weather(location):
+    """
+    Fetch current weather for a location from WeatherAPI.
+    """
+    with metrics.timed("upstream_fetch"):
+        response = await weather_client.get(BASE_URL, params={"key": API_KEY, "q": location, "aqi": "no"})
 
-        if "error" in weather_data:
-            raise HTTPException(
-                status_code=404,
-                detail=f"Location '{location}' not found. Please provide a valid location."
-            )
+    if response.status_code == 400 and "error" in response.json():
+        raise HTTPException(
+            status_code=404,
+            detail=f"Location '{location}' not found. Please provide a valid location."
+        )
+    response.raise_for_status()
 
-        filtered_data = {
-            "location": weather_data["location"]["name"],
-            "region": weather_data["location"]["region"],
-            "country": weather_data["location"]["country"],
-            "condition": weather_data["current"]["condition"]["text"],
-            "temperature_c": weather_data["current"]["temp_c"],
-            "wind_speed_kph": weather_data["current"]["wind_kph"],
-            "precipitation_mm": weather_data["current"]["precip_mm"],
-            "date": weather_data["location"]["localtime"],
-        }
+    weather_data = response.json()
 
-        save_to_db(filtered_data)
+    return {
+        "location": weather_data["location"]["name"],
+        "region": weather_data["location"]["region"],
+        "country": weather_data["location"]["country"],
+        "condition": weather_data["current"]["condition"]["text"],
+        "temperature_c": weather_data["current"]["temp_c"],
+        "wind_speed_kph": weather_data["current"]["wind_kph"],
+        "precipitation_mm": weather_data["current"]["precip_mm"],
+        "date": weather_data["location"]["localtime"],
+    }
+
+async def fetch_and_save_weather(location):
+    filtered_data = await fetch_weather(location)
+    if write_queue.running:
+        await write_queue.put(filtered_data)
+    elif await run_in_threadpool(save_to_db, filtered_data) is None:
+        # Raising keeps the unsaved reading out of the weather cache.
+        raise HTTPException(status_code=500, detail="Weather data was fetched but could not be saved.")
+    return filtered_data
+
+@app.get("/get_weather/")
+async def get_weather(location: str, fresh: bool = False):
+    """
+    Fetch weather data for a given location.
 
-        return filtered_data
+    Results are cached per normalized location for WEATHER_CACHE_TTL seconds;
+    pass `fresh=true` to bypass the cache and hit WeatherAPI directly. With
+    PREFETCH enabled, popular locations are refreshed before they expire.
+    """
+    key = normalize_location(location)
+    prefetcher.track(key)
+    try:
+        return await weather_cache.aget_or_load(
+            key,
+            lambda: fetch_and_save_weather(location),
+            bypass=fresh,
+        )
 
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
+        metrics.record_error(e, "get_weather")
         raise HTTPException(
             status_code=501,
             detail="An error occurred while fetching weather data. Please try again later."
         )
     except Exception as e:
+        metrics.record_error(e, "get_weather")
         raise HTTPException(
             status_code=500,
             detail=f"An unexpected error occurred: {str(e)}"
         )
 
+class BatchWeatherRequest(BaseModel):
+    locations: list[str]
+    concurrency: int | None = None
+    fresh: bool = False
+
+@app.post("/get_weather/batch")
+async def get_weather_batch(request: BatchWeatherRequest):
+    """
+    Fetch weather data for many locations concurrently and store them in one transaction.
+
+    Returns one entry per requested location, either with its `data` or with the
+    `error` and `status_code` it failed with.
+    """
+    if len(request.locations) > WEATHER_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many locations. At most {WEATHER_BATCH_MAX_SIZE} are allowed per batch."
+        )
+
+    concurrency = min(request.concurrency or WEATHER_BATCH_CONCURRENCY, WEATHER_BATCH_CONCURRENCY)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def fetch_one(location):
+        key = normalize_location(location)
+        prefetcher.track(key)
+        try:
+            async with semaphore:
+                data = await weather_cache.aget_or_load(
+                    key,
+                    lambda: fetch_weather(location),
+                    bypass=request.fresh,
+                )
+            return {"location": location, "data": data}
+        except HTTPException as e:
+            return {"location": location, "error": e.detail, "status_code": e.status_code}
+        except httpx.HTTPError:
+            return {"location": location, "error": "An error occurred while fetching weather data.", "status_code": 501}
+        except Exception as e:
+            return {"location": location, "error": f"An unexpected error occurred: {str(e)}", "status_code": 500}
+
+    results = await asyncio.gather(*(fetch_one(location) for location in request.locations))
+
+    saved = await run_in_threadpool(save_many_to_db, [result["data"] for result in results if "data" in result])
+    if saved is None:
+        # Nothing was stored, so the cache must not keep serving these readings either.
+        for result in results:
+            if "data" in result:
+                weather_cache.discard(normalize_location(result["location"]))
+        raise HTTPException(status_code=500, detail="Weather data was fetched but could not be saved.")
+
+    return {
+        "results": results,
+        "succeeded": sum(1 for result in results if "data" in result),
+        "failed": sum(1 for result in results if "error" in result),
+        "inserted": saved["inserted"],
+    }
+
+@app.get("/youtube_videos/")
+async def youtube_videos(query: str):
+    """
+    Search YouTube for weather videos about a location on behalf of clients.
+
+    Results are shared across workers through a Postgres cache for YOUTUBE_CACHE_TTL
+    seconds. When the daily quota is spent or YouTube fails, the last cached results
+    are returned with `stale: true`.
+    """
+    return await youtube.search_videos(query)
+
+@app.get("/youtube_stats/")
+def youtube_stats():
+    """
+    Report today's YouTube quota usage and proxy cache counters.
+    """
+    return {**youtube.quota_usage(), **youtube.stats()}
+
 @app.get("/read_records/")
-def read_records():
+def read_records(
+    limit: int = Query(None, ge=1),
+    cursor: str = None,
+    location: str = None,
+    country: str = None,
+    start_date: datetime = None,
+    end_date: datetime = None,
+    sort: str = "id",
+    shape: str = "records",
+    if_none_match: str = Header(None),
+):
+    """
+    Fetch one page of records from the database.
+
+    Supports filtering by location, country and date range and sorting by `id`,
+    `-id`, `date` or `-date`. Pages hold at most READ_MAX_PAGE_SIZE records; when
+    more are available the `X-Next-Cursor` response header carries the `cursor`
+    value for the next page. Pages carry an ETag, and a request whose
+    `If-None-Match` still matches gets a 304 without reading any records.
+
+    `shape` selects the JSON layout: `records` (a list of objects), `rows`
+    (column names once plus one array per record) or `columns` (one array per
+    column). Rows are encoded straight from the database tuples.
+    """
+    if shape not in READ_SHAPES:
+        raise HTTPException(status_code=400, detail=f"Invalid shape. Use one of: {', '.join(READ_SHAPES)}.")
+    version = data_version()
+    etag = None
+    if version is not None:
+        etag = make_etag(version, limit, cursor, location, country, start_date, end_date, sort, shape)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    try:
+        result = read(limit, cursor, location, country, start_date, end_date, sort)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=500, detail="Failed to read records.")
+
+    rows, next_cursor = result
+    metrics.record_rows("/read_records/", len(rows))
+    headers = {}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if etag:
+        headers["ETag"] = etag
+    return FastJSONResponse(shape_rows(rows, shape), headers=headers)
+
+@app.get("/analytics/")
+def analytics(
+    location: str = None,
+    country: str = None,
+    start_date: date = None,
+    end_date: date = None,
+    limit: int = Query(None, ge=1),
+):
     """
-    Fetch all records from the database.
+    Daily min/max/avg temperature, total precipitation and max wind per location.
+
+    Served from the incrementally maintained weather_daily rollup table, so the
+    cost depends on the number of days and locations, not on raw readings.
     """
     try:
-        records = read()
-        return records
+        result = read_analytics(location, country, start_date, end_date, limit)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=500, detail="Failed to read analytics.")
+    metrics.record_rows("/analytics/", len(result))
+    return result
 
 @app.get("/delete_record/")
 def delete_record(record_id: int):
@@ -90,18 +431,126 @@ def update_record(record_id: int, condition: str):
     """
     try:
         result = update(record_id, condition)
-        if "Record not found" in result:
-            raise HTTPException(status_code=404, detail=result["message"])
-        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=500, detail="Failed to update record.")
+    if result["message"] == "Record not found":
+        raise HTTPException(status_code=404, detail=result["message"])
+    return result
+
+class RecordSelection(BaseModel):
+    ids: list[int] | None = None
+    location: str | None = None
+    country: str | None = None
+    start_date: datetime | None = None
+    end_date: datetime | None = None
+
+class BulkUpdateRequest(RecordSelection):
+    condition: str
+
+@app.post("/delete_records/")
+def delete_records(request: RecordSelection):
+    """
+    Delete many records in one transaction, selected by `ids` and/or filters.
+
+    Returns the ids that were deleted and their count.
+    """
+    try:
+        result = delete_many(request.ids, request.location, request.country, request.start_date, request.end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=500, detail="Failed to delete records.")
+    return result
+
+@app.put("/update_conditions/")
+def update_records(request: BulkUpdateRequest):
+    """
+    Update the weather condition of many records in one transaction, selected by
+    `ids` and/or filters.
+
+    Returns the ids that were updated and their count.
+    """
+    try:
+        result = update_many(
+            request.condition, request.ids, request.location, request.country, request.start_date, request.end_date
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=500, detail="Failed to update records.")
+    return result
+
+@app.get("/changes/")
+def get_changes(cursor: str = None, limit: int = Query(None, ge=1)):
+    """
+    Poll the change feed: inserts, updates and deletes after `cursor`, oldest first.
+
+    Without a cursor, returns no events and the current end of the feed; take it
+    before reading the records to keep a local copy in sync afterwards. Expired
+    cursors get a 410.
+    """
+    try:
+        if cursor is None:
+            return {"events": [], "cursor": changes.tail_cursor()}
+        events, cursor = changes.read_changes(cursor, min(limit or changes.CHANGE_FEED_BATCH_SIZE, changes.CHANGE_FEED_BATCH_SIZE))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except changes.CursorExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except Exception as e:
+        metrics.record_error(e, "get_changes")
+        raise HTTPException(status_code=500, detail="Failed to read changes.")
+    return FastJSONResponse({"events": events, "cursor": cursor})
+
+@app.get("/changes/stream")
+async def stream_changes(cursor: str = None, last_event_id: str = Header(None)):
+    """
+    Stream the change feed as Server-Sent Events, pushed as soon as changes commit.
+
+    Resumes after the `Last-Event-ID` header (sent by reconnecting EventSource
+    clients) or `cursor`, and starts at the current end of the feed otherwise.
+    """
+    cursor = last_event_id or cursor
+    try:
+        if cursor is None:
+            cursor = await run_in_threadpool(changes.tail_cursor)
+        else:
+            await run_in_threadpool(changes.check_cursor, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except changes.CursorExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    return StreamingResponse(
+        changes.stream_changes(cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/download_data/")
-def download_data(format: str):
+def download_data(
+    format: str,
+    gzip: bool = False,
+    compression: str = None,
+    location: str = None,
+    country: str = None,
+    start_date: datetime = None,
+    end_date: datetime = None,
+    if_none_match: str = Header(None),
+):
     """
-    Download all records in the specified format (JSON or CSV).
+    Download records in the specified format (JSON, CSV, Parquet or Feather).
+
+    The export is streamed from a server-side cursor in chunks, so memory use does
+    not grow with the table size. Pass `gzip=true` for a compressed CSV/JSON
+    download or `compression` to pick the Parquet/Feather codec. Takes the same
+    filters as `/read_records/` and honours `If-None-Match` the same way; unchanged
+    exports are served from memory.
     """
     try:
-        return download(format)
+        return download(format, gzip, compression, location, country, start_date, end_date, if_none_match)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache with per-entry expiry and an LRU size bound.
+
+    `aget_or_load` coalesces concurrent misses for the same key so that only one
+    caller runs the loader while the others wait for its result.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def ttl_remaining(self, key):
+        """
+        Seconds until `key` expires, or None if it is not cached. Does not count as a hit.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None:
+            return None
+        return max(entry[0] - time.monotonic(), 0.0)
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _set(self, key, value):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def aget_or_load(self, key, loader, bypass=False):
+        """
+        Return the cached value for `key`, awaiting `loader()` on a miss.
+
+        With `bypass=True` the cached value is ignored and the loader always runs;
+        its result still refreshes the cache. Loader errors are never cached.
+        Waiters share the leader's task, so a cancelled waiter does not cancel the
+        upstream call for everyone else.
+        """
+        if bypass:
+            with self._lock:
+                self.bypassed += 1
+            value = await loader()
+            self.set(key, value)
+            return value
+
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            task = self._inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._aload(key, loader))
+                self._inflight[key] = task
+            else:
+                self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    async def _aload(self, key, loader):
+        try:
+            value = await loader()
+            self.set(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class ExportCache:
+    """
+    Byte-bounded LRU cache of serialized exports, each tagged with the data version
+    it was built from. An entry is only served while that version is still current.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.too_large = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, version, content, media_type, headers):
+        if len(content) > self.max_entry_bytes or len(content) > self.max_bytes:
+            with self._lock:
+                self.too_large += 1
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[1][0])
+            self._data[key] = (version, (content, media_type, headers))
+            self._size += len(content)
+            self.stored += 1
+            while self._size > self.max_bytes:
+                _, (_, (evicted, _, _)) = self._data.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stored": self.stored,
+                "too_large": self.too_large,
+                "evictions": self.evictions,
+            }
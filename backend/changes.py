@@ -0,0 +1,311 @@
+"""
+Change feed for weather_data.
+
+Every insert, update, delete and truncate is recorded in the weather_changes table
+by database triggers (so all write paths are covered) and announced with
+NOTIFY weather_changes on commit. Bulk loads that set weather.skip_changes are
+recorded as a single `reset` event instead, after which clients re-read the data. Events are ordered by (transaction id, change id)
+and a cursor is the position of the last event a client has seen, written as
+"<txid>:<change id>". Only transactions older than the oldest one still running
+are returned, so events committed late are never skipped by a resumed cursor.
+
+Streams end after CHANGE_FEED_MAX_STREAM_SECONDS so workers can shut down;
+EventSource clients reconnect on their own and resume from Last-Event-ID.
+
+Events older than CHANGE_FEED_RETENTION_HOURS are pruned. Clients resuming from a
+pruned position get a 410 and should re-read the data with /read_records/.
+"""
+import asyncio
+import os
+import time
+import psycopg2
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from backend.database import DB_URL, get_connection
+from backend.encoding import dumps
+from backend.metrics import record_error
+
+load_dotenv()
+
+CHANGE_FEED_BATCH_SIZE = int(os.getenv("CHANGE_FEED_BATCH_SIZE", "500"))
+CHANGE_FEED_HEARTBEAT = float(os.getenv("CHANGE_FEED_HEARTBEAT", "15"))
+CHANGE_FEED_RETENTION_HOURS = float(os.getenv("CHANGE_FEED_RETENTION_HOURS", "24"))
+CHANGE_FEED_PRUNE_INTERVAL = float(os.getenv("CHANGE_FEED_PRUNE_INTERVAL", "600"))
+CHANGE_FEED_MAX_STREAM_SECONDS = float(os.getenv("CHANGE_FEED_MAX_STREAM_SECONDS", "300"))
+
+CHANNEL = "weather_changes"
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def parse_cursor(cursor):
+    try:
+        txid, change_id = cursor.split(":")
+        return int(txid), int(change_id)
+    except (AttributeError, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def format_cursor(txid, change_id):
+    return f"{txid}:{change_id}"
+
+
+def tail_cursor():
+    """
+    Cursor positioned after every change that is already visible.
+
+    Read it before taking a snapshot of the data (e.g. with /read_records/) and
+    resume the feed from it: changes committed in between are replayed.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint;")
+        xmin = cursor.fetchone()[0]
+        connection.commit()
+        cursor.close()
+    return format_cursor(xmin - 1, 2 ** 63 - 1)
+
+
+def check_pruned(db_cursor, txid, change_id):
+    db_cursor.execute("SELECT txid::text::bigint, change_id FROM weather_changes_pruned;")
+    pruned = db_cursor.fetchone()
+    if pruned is not None and (txid, change_id) < pruned:
+        raise CursorExpired("Cursor is older than the retained change history; re-read the records.")
+
+
+def check_cursor(cursor):
+    """
+    Validate `cursor`, raising ValueError if malformed and CursorExpired if pruned.
+    """
+    txid, change_id = parse_cursor(cursor)
+    with get_connection() as connection:
+        db_cursor = connection.cursor()
+        try:
+            check_pruned(db_cursor, txid, change_id)
+        finally:
+            connection.rollback()
+            db_cursor.close()
+
+
+def read_changes(cursor, limit=CHANGE_FEED_BATCH_SIZE):
+    """
+    Return up to `limit` events after `cursor` and the cursor of the last one.
+
+    Raises CursorExpired when events after `cursor` have already been pruned.
+    """
+    txid, change_id = parse_cursor(cursor)
+    with get_connection() as connection:
+        db_cursor = connection.cursor()
+        try:
+            check_pruned(db_cursor, txid, change_id)
+        except CursorExpired:
+            connection.rollback()
+            db_cursor.close()
+            raise
+        db_cursor.execute("""
+            SELECT txid::text::bigint, id, op, record_id, record, changed_at
+            FROM weather_changes
+            WHERE (txid, id) > (%s::text::xid8, %s)
+              AND txid < pg_snapshot_xmin(pg_current_snapshot())
+            ORDER BY txid, id
+            LIMIT %s;
+        """, (txid, change_id, limit))
+        rows = db_cursor.fetchall()
+        connection.commit()
+        db_cursor.close()
+
+    events = [
+        {
+            "cursor": format_cursor(row[0], row[1]),
+            "op": row[2],
+            "id": row[3],
+            "record": row[4],
+            "changed_at": row[5],
+        }
+        for row in rows
+    ]
+    if events:
+        cursor = events[-1]["cursor"]
+    return events, cursor
+
+
+def prune_changes(retention_hours=None):
+    """
+    Delete events older than `retention_hours` and remember the newest pruned position.
+    """
+    retention_hours = CHANGE_FEED_RETENTION_HOURS if retention_hours is None else retention_hours
+    try:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""
+                WITH pruned AS (
+                    DELETE FROM weather_changes
+                    WHERE changed_at < now() - %s * interval '1 hour'
+                    RETURNING txid, id
+                ), newest AS (
+                    SELECT txid, id FROM pruned ORDER BY txid DESC, id DESC LIMIT 1
+                ), watermark AS (
+                    INSERT INTO weather_changes_pruned AS p (id, txid, change_id)
+                    SELECT true, txid, id FROM newest
+                    ON CONFLICT (id) DO UPDATE SET txid = EXCLUDED.txid, change_id = EXCLUDED.change_id
+                    WHERE (EXCLUDED.txid, EXCLUDED.change_id) > (p.txid, p.change_id)
+                )
+                SELECT count(*) FROM pruned;
+            """, (retention_hours,))
+            pruned = cursor.fetchone()[0]
+            connection.commit()
+            cursor.close()
+        return pruned
+    except Exception as e:
+        record_error(e, "prune_changes")
+
+
+class ChangeListener:
+    """
+    Holds one dedicated LISTEN connection per process and wakes every feed
+    subscriber when a change is committed.
+
+    Subscribers wait on `event`, which is replaced after each notification. When
+    the connection is lost it is re-opened in the background; subscribers keep
+    polling on their heartbeat meanwhile.
+    """
+
+    def __init__(self, dsn, reconnect_delay=5):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self.event = asyncio.Event()
+        self._connection = None
+        self._loop = None
+        self._reconnect = None
+        self.notifications = 0
+        self.reconnects = 0
+        self.subscribers = 0
+        self.events_sent = 0
+
+    @property
+    def listening(self):
+        return self._connection is not None
+
+    def _connect(self):
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL};")
+        return connection
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        try:
+            connection = await self._loop.run_in_executor(None, self._connect)
+        except Exception as e:
+            record_error(e, "change_listener")
+            self._schedule_reconnect()
+            return
+        self._connection = connection
+        self._loop.add_reader(connection.fileno(), self._on_readable)
+        # Notifications may have been missed while disconnected.
+        self.wake()
+
+    async def stop(self):
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+        self._disconnect()
+
+    def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                self._loop.remove_reader(connection.fileno())
+            except (ValueError, OSError):
+                pass
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+
+    def _schedule_reconnect(self):
+        async def reconnect():
+            await asyncio.sleep(self.reconnect_delay)
+            self._reconnect = None
+            self.reconnects += 1
+            await self.start()
+
+        if self._reconnect is None:
+            self._reconnect = self._loop.create_task(reconnect())
+
+    def _on_readable(self):
+        try:
+            self._connection.poll()
+        except psycopg2.Error as e:
+            record_error(e, "change_listener")
+            self._disconnect()
+            self._schedule_reconnect()
+            self.wake()
+            return
+        if self._connection.notifies:
+            self.notifications += len(self._connection.notifies)
+            self._connection.notifies.clear()
+            self.wake()
+
+    def wake(self):
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+
+    def stats(self):
+        return {
+            "listening": self.listening,
+            "subscribers": self.subscribers,
+            "notifications": self.notifications,
+            "events_sent": self.events_sent,
+            "reconnects": self.reconnects,
+        }
+
+
+listener = ChangeListener(DB_URL)
+
+
+async def stream_changes(cursor):
+    """
+    Yield Server-Sent Events for every change after `cursor`.
+
+    Each event's `id` is its cursor, so a reconnecting EventSource resumes where
+    it stopped. The opening message and the keep-alive comment sent every
+    CHANGE_FEED_HEARTBEAT seconds without changes carry the current cursor as
+    well, so a stream that saw no events still resumes from where it started.
+    Each heartbeat also re-checks for events held back by transactions that were
+    still running.
+    """
+    deadline = time.monotonic() + CHANGE_FEED_MAX_STREAM_SECONDS
+    listener.subscribers += 1
+    try:
+        yield f"retry: 1000\nid: {cursor}\n\n"
+        while time.monotonic() < deadline:
+            wakeup = listener.event
+            try:
+                events, cursor = await run_in_threadpool(read_changes, cursor)
+            except CursorExpired as e:
+                yield f"event: reset\ndata: {dumps({'detail': str(e)}).decode()}\n\n"
+                return
+            except Exception as e:
+                record_error(e, "stream_changes")
+                events = []
+            for event in events:
+                yield f"id: {event['cursor']}\ndata: {dumps(event).decode()}\n\n"
+            listener.events_sent += len(events)
+            if len(events) >= CHANGE_FEED_BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), min(CHANGE_FEED_HEARTBEAT, max(deadline - time.monotonic(), 0)))
+            except asyncio.TimeoutError:
+                yield f"id: {cursor}\n: keep-alive\n\n"
+    finally:
+        listener.subscribers -= 1
+
+
+async def run_pruning():
+    while True:
+        await run_in_threadpool(prune_changes)
+        await asyncio.sleep(CHANGE_FEED_PRUNE_INTERVAL)
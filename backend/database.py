@@ -1,12 +1,25 @@
-import requests
 from dotenv import load_dotenv
 import os
+import threading
+import time
+import base64
+import functools
+import hashlib
+import importlib.util
+import csv
+import io
+import itertools
+import json
+import uuid
+import zlib
+from contextlib import contextmanager
 import psycopg2
 from psycopg2 import sql
-from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
-import pandas as pd
+from psycopg2.extras import execute_values
+from backend.cache import ExportCache
+from backend.metrics import record_error, record_rows, record_stage, timed
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
 from datetime import datetime
 
 load_dotenv()
@@ -19,175 +32,1252 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 
 DB_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-def create_table_if_not_exists():
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))
+
+READ_DEFAULT_PAGE_SIZE = int(os.getenv("READ_DEFAULT_PAGE_SIZE", "100"))
+READ_MAX_PAGE_SIZE = int(os.getenv("READ_MAX_PAGE_SIZE", "1000"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", "5000"))
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", "100000"))
+WEATHER_PARTITIONING = os.getenv("WEATHER_PARTITIONING", "false").lower() in ("1", "true", "yes")
+ANALYTICS_DEFAULT_LIMIT = int(os.getenv("ANALYTICS_DEFAULT_LIMIT", "1000"))
+ANALYTICS_MAX_LIMIT = int(os.getenv("ANALYTICS_MAX_LIMIT", "10000"))
+BULK_MAX_IDS = int(os.getenv("BULK_MAX_IDS", "10000"))
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EXPORT_CACHE_ENTRY_MAX_BYTES = int(os.getenv("EXPORT_CACHE_ENTRY_MAX_BYTES", str(16 * 1024 * 1024)))
+
+COLUMNS = ["id", "location", "region", "country", "condition", "temperature_c", "wind_speed_kph", "precipitation_mm", "date"]
+SORT_OPTIONS = ("id", "-id", "date", "-date")
+READ_SHAPES = ("records", "rows", "columns")
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that records how long each statement takes, labelled by its SQL verb.
+    """
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_stage(f"db_query_{statement_kind(query)}", time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_stage("db_query_copy", time.perf_counter() - started)
+
+
+def statement_kind(query):
+    if isinstance(query, bytes):
+        query = query[:20].decode(errors="ignore")
+    elif not isinstance(query, str):
+        return "other"
+    words = query.split(None, 1)
+    return words[0].lower() if words else "other"
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of PostgreSQL connections shared by every database function.
+
+    Up to `max_size` connections are opened lazily and kept open between requests.
+    Checkouts block for at most `timeout` seconds when all of them are in use.
+    Connections that sat idle for longer than `check_idle` seconds are pinged
+    before being handed out and replaced if the ping fails.
+    """
+
+    def __init__(self, dsn, min_size, max_size, timeout, check_idle):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._idle = []
+        self._opened = 0
+        self._closed = True
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._in_use = 0
+        self._acquired = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def open(self):
+        with self._lock:
+            if not self._closed:
+                return
+            self._closed = False
+        warm = []
+        for _ in range(self.min_size):
+            warm.append((self._connect(), time.monotonic()))
+        with self._lock:
+            self._idle.extend(warm)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._closed = True
+        for connection, _ in idle:
+            self._disconnect(connection)
+
+    def _connect(self):
+        with timed("db_connect"):
+            connection = psycopg2.connect(self.dsn, cursor_factory=TimedCursor)
+        with self._lock:
+            self._opened += 1
+        return connection
+
+    def _disconnect(self, connection):
+        with self._lock:
+            self._opened -= 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _healthy(self, connection, last_used):
+        if connection.closed:
+            return False
+        if time.monotonic() - last_used < self.check_idle:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self):
+        if self._closed:
+            self.open()
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"Timed out after {self.timeout}s waiting for a database connection")
+        waited = time.monotonic() - started
+        record_stage("db_acquire", waited)
+
+        try:
+            connection = None
+            while connection is None:
+                with self._lock:
+                    candidate = self._idle.pop() if self._idle else None
+                if candidate is None:
+                    connection = self._connect()
+                elif self._healthy(*candidate):
+                    connection = candidate[0]
+                else:
+                    self._disconnect(candidate[0])
+                    with self._lock:
+                        self._discarded += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return connection
+
+    def release(self, connection, discard=False):
+        try:
+            if not discard and not connection.closed:
+                try:
+                    if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+            else:
+                discard = True
+
+            with self._lock:
+                keep = not discard and not self._closed
+                if keep:
+                    self._idle.append((connection, time.monotonic()))
+            if not keep:
+                self._disconnect(connection)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                if discard:
+                    self._discarded += 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "open": self._opened,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "acquired": self._acquired,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_total_s": round(self._wait_total, 6),
+                "wait_avg_s": round(self._wait_total / self._acquired, 6) if self._acquired else 0.0,
+                "wait_max_s": round(self._wait_max, 6),
+            }
+
+
+pool = ConnectionPool(DB_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_CHECK_IDLE)
+
+
+def get_connection():
+    return pool.connection()
+
+
+def open_pool():
+    pool.open()
+
+
+def close_pool():
+    pool.close()
+
+
+def pool_stats():
+    return pool.stats()
+
+ROLLUP_COLUMNS = [
+    "location", "day", "country", "readings", "min_temperature_c", "max_temperature_c",
+    "avg_temperature_c", "total_precipitation_mm", "max_wind_speed_kph",
+]
+
+# Daily per-location aggregates, kept current by statement-level triggers on
+# weather_data so every write path (single saves, batches, COPY ingestion,
+# updates, deletes and truncates) maintains them. Inserts are merged incrementally;
+# deletes and updates recompute only the (location, day) pairs they touched, and a
+# truncate clears them. Maintenance jobs that rewrite raw readings set
+# `weather.skip_rollups` to leave them as is. A later update or delete on a day
+# that was compacted recomputes it from the remaining hourly averages, so from
+# then on its readings count, min and max describe those averages instead.
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS weather_daily (
+    location VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    country VARCHAR(255),
+    readings INTEGER NOT NULL,
+    temperature_count INTEGER NOT NULL,
+    temperature_sum FLOAT,
+    min_temperature_c FLOAT,
+    max_temperature_c FLOAT,
+    total_precipitation_mm FLOAT,
+    max_wind_speed_kph FLOAT,
+    PRIMARY KEY (location, day)
+);
+CREATE INDEX IF NOT EXISTS weather_daily_day_idx ON weather_daily (day);
+
+CREATE OR REPLACE FUNCTION weather_daily_refresh(p_locations TEXT[], p_days DATE[]) RETURNS void AS $$
+    DELETE FROM weather_daily d
+    USING unnest(p_locations, p_days) AS k (location, day)
+    WHERE d.location = k.location AND d.day = k.day;
+
+    INSERT INTO weather_daily (location, day, country, readings, temperature_count, temperature_sum,
+                               min_temperature_c, max_temperature_c, total_precipitation_mm, max_wind_speed_kph)
+    SELECT w.location, k.day, max(w.country), count(*), count(w.temperature_c), sum(w.temperature_c),
+           min(w.temperature_c), max(w.temperature_c), sum(w.precipitation_mm), max(w.wind_speed_kph)
+    FROM unnest(p_locations, p_days) AS k (location, day)
+    JOIN weather_data w ON w.location = k.location AND w.date >= k.day AND w.date < k.day + 1
+    GROUP BY w.location, k.day;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION weather_daily_after_insert() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('weather.skip_rollups', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO weather_daily AS d (location, day, country, readings, temperature_count, temperature_sum,
+                                    min_temperature_c, max_temperature_c, total_precipitation_mm, max_wind_speed_kph)
+    SELECT location, date::date, max(country), count(*), count(temperature_c), sum(temperature_c),
+           min(temperature_c), max(temperature_c), sum(precipitation_mm), max(wind_speed_kph)
+    FROM new_rows
+    WHERE location IS NOT NULL AND date IS NOT NULL
+    GROUP BY location, date::date
+    ON CONFLICT (location, day) DO UPDATE SET
+        country = COALESCE(EXCLUDED.country, d.country),
+        readings = d.readings + EXCLUDED.readings,
+        temperature_count = d.temperature_count + EXCLUDED.temperature_count,
+        temperature_sum = COALESCE(d.temperature_sum + EXCLUDED.temperature_sum, d.temperature_sum, EXCLUDED.temperature_sum),
+        min_temperature_c = LEAST(d.min_temperature_c, EXCLUDED.min_temperature_c),
+        max_temperature_c = GREATEST(d.max_temperature_c, EXCLUDED.max_temperature_c),
+        total_precipitation_mm = COALESCE(d.total_precipitation_mm + EXCLUDED.total_precipitation_mm,
+                                          d.total_precipitation_mm, EXCLUDED.total_precipitation_mm),
+        max_wind_speed_kph = GREATEST(d.max_wind_speed_kph, EXCLUDED.max_wind_speed_kph);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION weather_daily_after_delete() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('weather.skip_rollups', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    PERFORM weather_daily_refresh(array_agg(location), array_agg(day))
+    FROM (
+        SELECT DISTINCT location, date::date AS day FROM old_rows
+        WHERE location IS NOT NULL AND date IS NOT NULL
+    ) affected
+    HAVING count(*) > 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION weather_daily_after_update() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('weather.skip_rollups', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    PERFORM weather_daily_refresh(array_agg(location), array_agg(day))
+    FROM (
+        SELECT o.location, o.date::date AS day
+        FROM old_rows o JOIN new_rows n ON n.id = o.id
+        WHERE (o.location, o.country, o.date, o.temperature_c, o.wind_speed_kph, o.precipitation_mm)
+              IS DISTINCT FROM (n.location, n.country, n.date, n.temperature_c, n.wind_speed_kph, n.precipitation_mm)
+        UNION
+        SELECT n.location, n.date::date
+        FROM old_rows o JOIN new_rows n ON n.id = o.id
+        WHERE (o.location, o.country, o.date, o.temperature_c, o.wind_speed_kph, o.precipitation_mm)
+              IS DISTINCT FROM (n.location, n.country, n.date, n.temperature_c, n.wind_speed_kph, n.precipitation_mm)
+    ) affected
+    WHERE location IS NOT NULL AND day IS NOT NULL
+    HAVING count(*) > 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
+CREATE OR REPLACE FUNCTION weather_daily_after_truncate() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('weather.skip_rollups', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    TRUNCATE weather_daily;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS weather_daily_insert ON weather_data;
+CREATE TRIGGER weather_daily_insert AFTER INSERT ON weather_data
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION weather_daily_after_insert();
+DROP TRIGGER IF EXISTS weather_daily_delete ON weather_data;
+CREATE TRIGGER weather_daily_delete AFTER DELETE ON weather_data
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION weather_daily_after_delete();
+DROP TRIGGER IF EXISTS weather_daily_update ON weather_data;
+CREATE TRIGGER weather_daily_update AFTER UPDATE ON weather_data
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION weather_daily_after_update();
+DROP TRIGGER IF EXISTS weather_daily_truncate ON weather_data;
+CREATE TRIGGER weather_daily_truncate AFTER TRUNCATE ON weather_data
+    FOR EACH STATEMENT EXECUTE FUNCTION weather_daily_after_truncate();
+"""
+
+
+# A single-row counter bumped by every statement that changes weather_data (and
+# by partition retention, which bypasses the triggers). The bump is part of the
+# writing transaction, so a reader never sees a version before the rows it
+# stands for are visible.
+VERSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS weather_data_version (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    version BIGINT NOT NULL
+);
+INSERT INTO weather_data_version (id, version) VALUES (true, 1) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION weather_data_bump_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM 1 FROM old_rows LIMIT 1;
+    ELSIF TG_OP = 'TRUNCATE' THEN
+        PERFORM 1;
+    ELSE
+        PERFORM 1 FROM new_rows LIMIT 1;
+    END IF;
+    IF FOUND THEN
+        UPDATE weather_data_version SET version = version + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS weather_data_version_insert ON weather_data;
+CREATE TRIGGER weather_data_version_insert AFTER INSERT ON weather_data
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION weather_data_bump_version();
+DROP TRIGGER IF EXISTS weather_data_version_update ON weather_data;
+CREATE TRIGGER weather_data_version_update AFTER UPDATE ON weather_data
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION weather_data_bump_version();
+DROP TRIGGER IF EXISTS weather_data_version_delete ON weather_data;
+CREATE TRIGGER weather_data_version_delete AFTER DELETE ON weather_data
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION weather_data_bump_version();
+DROP TRIGGER IF EXISTS weather_data_version_truncate ON weather_data;
+CREATE TRIGGER weather_data_version_truncate AFTER TRUNCATE ON weather_data
+    FOR EACH STATEMENT EXECUTE FUNCTION weather_data_bump_version();
+"""
+
+
+# Change log behind the /changes/ feed: one row per inserted, updated or deleted
+# record, tagged with the writing transaction's id, plus a NOTIFY on commit.
+# Readers order events by (txid, id) and only return transactions older than
+# the oldest one still running, so a late commit can never slip behind a cursor.
+# Bulk loads set `weather.skip_changes` to log one `reset` event per transaction
+# instead of a JSONB copy of every row; clients re-read the records on a reset.
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS weather_changes (
+    id BIGSERIAL PRIMARY KEY,
+    txid XID8 NOT NULL,
+    op TEXT NOT NULL,
+    record_id INTEGER,
+    record JSONB,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS weather_changes_txid_id_idx ON weather_changes (txid, id);
+CREATE INDEX IF NOT EXISTS weather_changes_changed_at_idx ON weather_changes (changed_at);
+CREATE TABLE IF NOT EXISTS weather_changes_pruned (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    txid XID8 NOT NULL,
+    change_id BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION weather_changes_reset() RETURNS void AS $$
+    INSERT INTO weather_changes (txid, op)
+    SELECT pg_current_xact_id(), 'reset'
+    WHERE NOT EXISTS (SELECT 1 FROM weather_changes WHERE txid = pg_current_xact_id() AND op = 'reset');
+    SELECT pg_notify('weather_changes', '');
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION weather_changes_capture() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'TRUNCATE' AND current_setting('weather.skip_changes', true) = 'on' THEN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM 1 FROM old_rows LIMIT 1;
+        ELSE
+            PERFORM 1 FROM new_rows LIMIT 1;
+        END IF;
+        IF FOUND THEN
+            PERFORM weather_changes_reset();
+        END IF;
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO weather_changes (txid, op, record_id, record)
+        SELECT pg_current_xact_id(), 'insert', n.id, to_jsonb(n) FROM new_rows n ORDER BY n.id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO weather_changes (txid, op, record_id, record)
+        SELECT pg_current_xact_id(), 'update', n.id, to_jsonb(n) FROM new_rows n ORDER BY n.id;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO weather_changes (txid, op, record_id)
+        SELECT pg_current_xact_id(), 'delete', o.id FROM old_rows o ORDER BY o.id;
+    ELSE
+        INSERT INTO weather_changes (txid, op) VALUES (pg_current_xact_id(), 'truncate');
+    END IF;
+    IF FOUND THEN
+        PERFORM pg_notify('weather_changes', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS weather_changes_insert ON weather_data;
+CREATE TRIGGER weather_changes_insert AFTER INSERT ON weather_data
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION weather_changes_capture();
+DROP TRIGGER IF EXISTS weather_changes_update ON weather_data;
+CREATE TRIGGER weather_changes_update AFTER UPDATE ON weather_data
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION weather_changes_capture();
+DROP TRIGGER IF EXISTS weather_changes_delete ON weather_data;
+CREATE TRIGGER weather_changes_delete AFTER DELETE ON weather_data
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION weather_changes_capture();
+DROP TRIGGER IF EXISTS weather_changes_truncate ON weather_data;
+CREATE TRIGGER weather_changes_truncate AFTER TRUNCATE ON weather_data
+    FOR EACH STATEMENT EXECUTE FUNCTION weather_changes_capture();
+"""
+
+def create_rollups(cursor):
+    cursor.execute("SELECT to_regclass('weather_daily');")
+    backfill = cursor.fetchone()[0] is None
+    cursor.execute(ROLLUP_SCHEMA)
+    if backfill:
+        cursor.execute("""
+            INSERT INTO weather_daily (location, day, country, readings, temperature_count, temperature_sum,
+                                       min_temperature_c, max_temperature_c, total_precipitation_mm, max_wind_speed_kph)
+            SELECT location, date::date, max(country), count(*), count(temperature_c), sum(temperature_c),
+                   min(temperature_c), max(temperature_c), sum(precipitation_mm), max(wind_speed_kph)
+            FROM weather_data
+            WHERE location IS NOT NULL AND date IS NOT NULL
+            GROUP BY location, date::date;
+        """)
+
+
+WEATHER_TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS weather_data (
+    id SERIAL PRIMARY KEY,
+    location VARCHAR(255),
+    region VARCHAR(255),
+    country VARCHAR(255),
+    condition VARCHAR(255),
+    temperature_c FLOAT,
+    wind_speed_kph FLOAT,
+    precipitation_mm FLOAT,
+    date TIMESTAMP,
+    CONSTRAINT weather_data_location_date_key UNIQUE (location, date)
+);
+"""
+
+WEATHER_INDEXES = """
+DROP INDEX IF EXISTS weather_data_location_date_idx;
+CREATE INDEX IF NOT EXISTS weather_data_date_id_idx ON weather_data (date, id);
+CREATE INDEX IF NOT EXISTS weather_data_country_idx ON weather_data (country);
+"""
+
+# Changes whenever any of the DDL above does, so upgraded code re-applies it once.
+SCHEMA_VERSION = hashlib.blake2s(
+    (WEATHER_TABLE_SCHEMA + WEATHER_INDEXES + ROLLUP_SCHEMA + VERSION_SCHEMA + CHANGES_SCHEMA).encode(), digest_size=8
+).hexdigest()
+
+
+_schema_ready = False
+
+
+def create_table_if_not_exists(force=False):
+    """
+    Create or upgrade the weather_data table, its indexes, rollups, version
+    triggers and change log.
+
+    Concurrent callers (one per worker) are serialized with an advisory lock, and
+    the DDL is skipped when the recorded schema version is current, so trigger
+    replacement does not lock weather_data on every start. Pass `force` to
+    re-apply it anyway, e.g. after the table was rebuilt.
+    """
+    global _schema_ready
     try:
-        connection = psycopg2.connect(DB_URL)
-        cursor = connection.cursor()
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS weather_data (
-            id SERIAL PRIMARY KEY,
-            location VARCHAR(255),
-            region VARCHAR(255),
-            country VARCHAR(255),
-            condition VARCHAR(255),
-            temperature_c FLOAT,
-            wind_speed_kph FLOAT,
-            precipitation_mm FLOAT,
-            date TIMESTAMP
-        );
-        """
-        cursor.execute(create_table_query)
-        connection.commit()
-        cursor.close()
-        connection.close()
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('weather_schema'));")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS weather_schema_version (
+                    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+                    version TEXT NOT NULL
+                );
+            """)
+            if not force:
+                cursor.execute("SELECT version FROM weather_schema_version WHERE to_regclass('weather_data') IS NOT NULL;")
+                row = cursor.fetchone()
+                if row is not None and row[0] == SCHEMA_VERSION:
+                    connection.commit()
+                    cursor.close()
+                    _schema_ready = True
+                    return
+            if WEATHER_PARTITIONING:
+                from backend.partitions import create_partitioned_table
+
+                cursor.execute("SELECT to_regclass('weather_data');")
+                if cursor.fetchone()[0] is None:
+                    create_partitioned_table(cursor)
+            cursor.execute(WEATHER_TABLE_SCHEMA)
+            cursor.execute("SELECT to_regclass('weather_data_location_date_key');")
+            if cursor.fetchone()[0] is None:
+                # Tables created before the unique key may hold duplicates from racing saves.
+                cursor.execute("""
+                    DELETE FROM weather_data a USING weather_data b
+                    WHERE a.location = b.location AND a.date = b.date AND a.id > b.id;
+                """)
+                cursor.execute("""
+                    ALTER TABLE weather_data
+                    ADD CONSTRAINT weather_data_location_date_key UNIQUE (location, date);
+                """)
+            cursor.execute(WEATHER_INDEXES)
+            create_rollups(cursor)
+            cursor.execute(VERSION_SCHEMA)
+            cursor.execute(CHANGES_SCHEMA)
+            cursor.execute("""
+                INSERT INTO weather_schema_version (id, version) VALUES (true, %s)
+                ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version;
+            """, (SCHEMA_VERSION,))
+            connection.commit()
+            cursor.close()
+        _schema_ready = True
     except Exception as e:
-        print(e)
+        record_error(e, "create_table_if_not_exists")
+
+
+def ensure_schema():
+    """
+    Make sure the schema was created in this process before relying on it, e.g.
+    on the (location, date) key. Retries when an earlier attempt failed.
+    """
+    if not _schema_ready:
+        create_table_if_not_exists()
+
 
 def save_to_db(data):
+    """
+    Insert a weather record unless one already exists for the same location and date.
+    """
     try:
-        connection = psycopg2.connect(DB_URL)
-        cursor = connection.cursor()
-
-        check_query = """
-        SELECT 1 FROM weather_data WHERE location = %s AND date = %s LIMIT 1;
-        """
-        cursor.execute(check_query, (data["location"], data["date"]))
-        existing_record = cursor.fetchone()
+        ensure_schema()
+        with get_connection() as connection:
+            cursor = connection.cursor()
 
-        if existing_record:
+            insert_query = sql.SQL(
+                """
+                INSERT INTO weather_data (location, region, country, condition, temperature_c, wind_speed_kph, precipitation_mm, date)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (location, date) DO NOTHING
+                RETURNING id;
+                """
+            )
+            cursor.execute(
+                insert_query,
+                (
+                    data["location"],
+                    data["region"],
+                    data["country"],
+                    data["condition"],
+                    data["temperature_c"],
+                    data["wind_speed_kph"],
+                    data["precipitation_mm"],
+                    data["date"],
+                ),
+            )
+            inserted = cursor.fetchone()
+            connection.commit()
             cursor.close()
-            connection.close()
-            return {"message": "Record already exists in the database"}
 
-        insert_query = sql.SQL(
-            """
+        if inserted is None:
+            return {"message": "Record already exists in the database", "inserted": False}
+        return {"message": "Record added successfully", "inserted": True, "id": inserted[0]}
+
+    except Exception as e:
+        record_error(e, "save_to_db")
+
+
+
+def save_many_to_db(records):
+    """
+    Insert many weather records in one transaction with a single multi-row INSERT.
+    Records already stored for the same location and date are skipped.
+    """
+    unique = {}
+    for data in records:
+        unique.setdefault((data["location"], data["date"]), data)
+    if not unique:
+        return {"message": "No records to add", "inserted": 0}
+
+    try:
+        ensure_schema()
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            insert_query = """
             INSERT INTO weather_data (location, region, country, condition, temperature_c, wind_speed_kph, precipitation_mm, date)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            SELECT v.location, v.region, v.country, v.condition, v.temperature_c, v.wind_speed_kph, v.precipitation_mm, v.date
+            FROM (VALUES %s) AS v (location, region, country, condition, temperature_c, wind_speed_kph, precipitation_mm, date)
+            ON CONFLICT (location, date) DO NOTHING;
             """
-        )
-        cursor.execute(
-            insert_query,
-            (
-                data["location"],
-                data["region"],
-                data["country"],
-                data["condition"],
-                data["temperature_c"],
-                data["wind_speed_kph"],
-                data["precipitation_mm"],
-                data["date"],
-            ),
-        )
-        connection.commit()
-        cursor.close()
-        connection.close()
-        return {"message": "Record added successfully"}
+            execute_values(
+                cursor,
+                insert_query,
+                [
+                    (
+                        data["location"],
+                        data["region"],
+                        data["country"],
+                        data["condition"],
+                        data["temperature_c"],
+                        data["wind_speed_kph"],
+                        data["precipitation_mm"],
+                        data["date"],
+                    )
+                    for data in unique.values()
+                ],
+                template="(%s, %s, %s, %s, %s::float, %s::float, %s::float, %s::timestamp)",
+                page_size=len(unique),
+            )
+            inserted = cursor.rowcount
+            connection.commit()
+            cursor.close()
+        return {"message": f"{inserted} records added successfully", "inserted": inserted}
+
+    except Exception as e:
+        record_error(e, "save_many_to_db")
+
+
+def data_version():
+    """
+    Return the current weather_data version, or None if it cannot be read.
+
+    Read it before the data it describes: rows committed in between are then
+    labelled with an older version, which only causes one extra refresh.
+    """
+    try:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT version FROM weather_data_version;")
+            row = cursor.fetchone()
+            connection.commit()
+            cursor.close()
+        return row[0] if row else None
+    except Exception as e:
+        record_error(e, "data_version")
+
 
+def make_etag(version, *parts):
+    digest = hashlib.blake2s(repr(parts).encode(), digest_size=8).hexdigest()
+    return f'"{version}-{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match or etag is None:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or any(value.removeprefix("W/") == etag for value in candidates)
+
+
+def build_filters(location=None, country=None, start_date=None, end_date=None):
+    """
+    Build the WHERE conditions and parameters shared by record reads and exports.
+    """
+    conditions = []
+    params = []
+    if location:
+        conditions.append("location = %s")
+        params.append(location)
+    if country:
+        conditions.append("country = %s")
+        params.append(country)
+    if start_date:
+        conditions.append("date >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("date <= %s")
+        params.append(end_date)
+    return conditions, params
+
+
+def encode_cursor(sort, row):
+    # For date sorts a None key means the last row had no date.
+    key = row[8].isoformat() if sort.lstrip("-") == "date" and row[8] is not None else None
+    payload = json.dumps([sort, key, row[0]]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort, key, last_id = json.loads(payload)
+        if key is not None:
+            key = datetime.fromisoformat(key)
+        return sort, key, int(last_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def read(limit=None, cursor=None, location=None, country=None, start_date=None, end_date=None, sort="id"):
+    """
+    Read one page of records using keyset pagination.
+
+    Returns the rows as tuples in COLUMNS order and an opaque cursor for the next
+    page (None on the last page). The cursor is only valid together with the same
+    `sort` value.
+    """
+    if sort not in SORT_OPTIONS:
+        raise ValueError(f"Invalid sort. Use one of: {', '.join(SORT_OPTIONS)}.")
+    limit = min(max(limit or READ_DEFAULT_PAGE_SIZE, 1), READ_MAX_PAGE_SIZE)
+    descending = sort.startswith("-")
+    field = sort.lstrip("-")
+    direction = "DESC" if descending else "ASC"
+    comparison = "<" if descending else ">"
+
+    conditions, params = build_filters(location, country, start_date, end_date)
+    if cursor:
+        cursor_sort, key, last_id = decode_cursor(cursor)
+        if cursor_sort != sort:
+            raise ValueError("Cursor does not match the requested sort.")
+        if field == "date":
+            # Rows without a date sort last ascending and first descending (the
+            # PostgreSQL default, which the (date, id) index serves both ways).
+            if key is None:
+                conditions.append(f"(date IS NULL AND id {comparison} %s{' OR date IS NOT NULL' if descending else ''})")
+                params.append(last_id)
+            else:
+                conditions.append(f"((date, id) {comparison} (%s, %s){'' if descending else ' OR date IS NULL'})")
+                params.extend([key, last_id])
+        else:
+            conditions.append(f"id {comparison} %s")
+            params.append(last_id)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = f"date {direction}, id {direction}" if field == "date" else f"id {direction}"
+    query = f"SELECT {', '.join(COLUMNS)} FROM weather_data {where} ORDER BY {order} LIMIT %s;"
+    params.append(limit + 1)
+
+    try:
+        with get_connection() as connection:
+            db_cursor = connection.cursor()
+            db_cursor.execute(query, params)
+            rows = db_cursor.fetchall()
+            connection.commit()
+            db_cursor.close()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(sort, rows[-1])
+        return rows, next_cursor
     except Exception as e:
-        print(e)
+        record_error(e, "read")
 
 
+def shape_rows(rows, shape="records"):
+    """
+    Arrange row tuples for a JSON response.
 
-def read():
+    `records` is a list of objects, `rows` is `{"columns": [...], "rows": [[...], ...]}`
+    with the column names given once, and `columns` maps each column name to an
+    array of its values.
+    """
+    if shape == "rows":
+        return {"columns": COLUMNS, "rows": rows}
+    if shape == "columns":
+        values = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+        return dict(zip(COLUMNS, values))
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+
+def read_analytics(location=None, country=None, start_date=None, end_date=None, limit=None):
+    """
+    Read daily per-location aggregates from the weather_daily rollup table,
+    newest day first.
+    """
+    limit = min(max(limit or ANALYTICS_DEFAULT_LIMIT, 1), ANALYTICS_MAX_LIMIT)
+    conditions, params = [], []
+    if location:
+        conditions.append("location = %s")
+        params.append(location)
+    if country:
+        conditions.append("country = %s")
+        params.append(country)
+    if start_date:
+        conditions.append("day >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("day <= %s")
+        params.append(end_date)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    params.append(limit)
 
     try:
-        connection = psycopg2.connect(DB_URL)
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM weather_data;")
-        rows = cursor.fetchall()
-        connection.commit()
-        cursor.close()
-        connection.close()
-        return [
-            {
-                "id": row[0],
-                "location": row[1],
-                "region": row[2],
-                "country": row[3],
-                "condition": row[4],
-                "temperature_c": row[5],
-                "wind_speed_kph": row[6],
-                "precipitation_mm": row[7],
-                "date": row[8],
-            }
-            for row in rows
-        ]
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"""
+                SELECT location, day, country, readings, min_temperature_c, max_temperature_c,
+                       temperature_sum / NULLIF(temperature_count, 0), total_precipitation_mm, max_wind_speed_kph
+                FROM weather_daily {where}
+                ORDER BY day DESC, location
+                LIMIT %s;
+            """, params)
+            rows = cursor.fetchall()
+            connection.commit()
+            cursor.close()
+        return [dict(zip(ROLLUP_COLUMNS, row)) for row in rows]
+    except Exception as e:
+        record_error(e, "read_analytics")
+
+
+def popular_locations(days, limit):
+    """
+    Return `(location, readings)` for the most frequently stored locations of the last `days` days.
+    """
+    try:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""
+                SELECT location, sum(readings) FROM weather_daily
+                WHERE day >= current_date - %s
+                GROUP BY location
+                ORDER BY 2 DESC
+                LIMIT %s;
+            """, (days, limit))
+            rows = cursor.fetchall()
+            connection.commit()
+            cursor.close()
+        return rows
     except Exception as e:
-        print(e)
+        record_error(e, "popular_locations")
+        return []
 
 
 def delete(record_id):
 
     try:
-        connection = psycopg2.connect(DB_URL)
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM weather_data WHERE id = %s;", (record_id,))
-        connection.commit()
-        cursor.close()
-        connection.close()
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM weather_data WHERE id = %s;", (record_id,))
+            connection.commit()
+            cursor.close()
         return {"message": f"Record with ID {record_id} deleted successfully."}
     except Exception as e:
-        print(e)
+        record_error(e, "delete")
 
 
 def update(record_id, condition):
+    """
+    Set the condition of one record with a single UPDATE ... RETURNING.
+    """
     try:
-        connection = psycopg2.connect(DB_URL)
-        cursor = connection.cursor()
-
-        cursor.execute("SELECT * FROM weather_data WHERE id = %s;", (record_id,))
-        existing_record = cursor.fetchone()
-
-        if not existing_record:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("UPDATE weather_data SET condition = %s WHERE id = %s RETURNING id;", (condition, record_id))
+            updated = cursor.fetchone()
+            connection.commit()
             cursor.close()
-            connection.close()
-            return {"message": "Record not found"}
-        
-        cursor.execute( """
-            UPDATE weather_data
-            SET condition = %s
-            WHERE id = %s;""", 
-        (condition, record_id))
-        connection.commit()
-
-        cursor.close()
-        connection.close()
 
+        if updated is None:
+            return {"message": "Record not found"}
         return {"message": "Condition updated successfully"}
 
     except Exception as e:
-        print(e)
+        record_error(e, "update")
+
 
-def download(format):
+def bulk_filters(ids=None, location=None, country=None, start_date=None, end_date=None):
+    """
+    Build the WHERE clause for a bulk update or delete from a list of ids and/or filters.
+
+    Refuses an empty selection so a missing body can never touch the whole table.
+    """
+    conditions, params = build_filters(location, country, start_date, end_date)
+    if ids is not None:
+        if not ids:
+            raise ValueError("'ids' must not be empty.")
+        if len(ids) > BULK_MAX_IDS:
+            raise ValueError(f"Too many ids. At most {BULK_MAX_IDS} are allowed per request.")
+        conditions.append("id = ANY(%s)")
+        params.append(list(ids))
+    if not conditions:
+        raise ValueError("Provide 'ids' or at least one filter.")
+    return "WHERE " + " AND ".join(conditions), params
+
+
+def update_many(condition, ids=None, location=None, country=None, start_date=None, end_date=None):
+    """
+    Set the condition of every selected record in one statement and transaction.
+    Returns the affected ids and their count.
+    """
+    where, params = bulk_filters(ids, location, country, start_date, end_date)
     try:
-        connection = psycopg2.connect(DB_URL)
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM weather_data;")
-        records = cursor.fetchall()
-        columns = ["id", "location", "region", "country", "condition", "temperature_c", "wind_speed_kph", "precipitation_mm", "date"]
-        df = pd.DataFrame(records, columns=columns)
-        df["date"] = df["date"].apply(lambda x: datetime.fromtimestamp(x).strftime('%Y-%m-%d %H:%M:%S') if isinstance(x, (int, float)) else x)
-
-        if format.lower() == "csv":
-            file_path = "weather_data.csv"
-            df.to_csv(file_path, index=False)
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"UPDATE weather_data SET condition = %s {where} RETURNING id;", [condition, *params])
+            updated = sorted(row[0] for row in cursor.fetchall())
+            connection.commit()
             cursor.close()
-            connection.close()
-            return FileResponse(file_path, media_type="text/csv", filename="weather_data.csv")
+        return {"message": f"{len(updated)} records updated successfully", "updated": len(updated), "ids": updated}
+    except Exception as e:
+        record_error(e, "update_many")
+
 
-        elif format.lower() == "json":
-            file_path = "weather_data.json"
-            df.to_json(file_path, orient="records", indent=4)
+def delete_many(ids=None, location=None, country=None, start_date=None, end_date=None):
+    """
+    Delete every selected record in one statement and transaction.
+    Returns the affected ids and their count.
+    """
+    where, params = bulk_filters(ids, location, country, start_date, end_date)
+    try:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"DELETE FROM weather_data {where} RETURNING id;", params)
+            deleted = sorted(row[0] for row in cursor.fetchall())
+            connection.commit()
             cursor.close()
-            connection.close()
-            return FileResponse(file_path, media_type="application/json", filename="weather_data.json")
+        return {"message": f"{len(deleted)} records deleted successfully", "deleted": len(deleted), "ids": deleted}
+    except Exception as e:
+        record_error(e, "delete_many")
 
+def stream_record_chunks(query, params=()):
+    """
+    Yield lists of rows for `query` from a named server-side cursor.
 
-        else:
+    The pooled connection stays checked out until the generator is exhausted or
+    closed, and only DOWNLOAD_CHUNK_SIZE rows are held in memory at a time.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor(name=f"weather_export_{uuid.uuid4().hex}")
+        try:
+            cursor.itersize = DOWNLOAD_CHUNK_SIZE
+            cursor.execute(query, params)
+            exported = 0
+            while True:
+                rows = cursor.fetchmany(DOWNLOAD_CHUNK_SIZE)
+                if not rows:
+                    break
+                exported += len(rows)
+                yield rows
+            record_rows("/download_data/", exported)
+        finally:
             cursor.close()
-            connection.close()
-            raise HTTPException(status_code=400, detail="Invalid format. Use 'csv' or 'json'.")
+            connection.rollback()
+
+
+def format_date(value):
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value)
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def csv_chunks(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(row[:8] + (format_date(row[8]),) for row in rows)
+        yield buffer.getvalue()
+
+
+def json_chunks(chunks):
+    yield "["
+    separator = ""
+    for rows in chunks:
+        parts = []
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            record["date"] = format_date(record["date"])
+            parts.append(separator + json.dumps(record))
+            separator = ","
+        yield "".join(parts)
+    yield "]"
+
+
+class ChunkSink:
+    """
+    Write-only file object that hands written bytes back to a streaming generator.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("location", pa.string()),
+        ("region", pa.string()),
+        ("country", pa.string()),
+        ("condition", pa.string()),
+        ("temperature_c", pa.float64()),
+        ("wind_speed_kph", pa.float64()),
+        ("precipitation_mm", pa.float64()),
+        ("date", pa.timestamp("us")),
+    ])
+
+
+def arrow_batch(rows, schema):
+    import pyarrow as pa
+
+    columns = list(zip(*rows)) if rows else [[] for _ in COLUMNS]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def parquet_chunks(chunks, compression=None):
+    """
+    Encode row chunks as a Parquet file, one row group per PARQUET_ROW_GROUP_SIZE rows.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema()
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression or "snappy")
+    pending = []
+    pending_rows = 0
+    for rows in chunks:
+        if not rows:
+            continue
+        pending.append(arrow_batch(rows, schema))
+        pending_rows += len(rows)
+        if pending_rows >= PARQUET_ROW_GROUP_SIZE:
+            writer.write_table(pa.Table.from_batches(pending, schema), row_group_size=pending_rows)
+            pending = []
+            pending_rows = 0
+            yield sink.drain()
+    if pending:
+        writer.write_table(pa.Table.from_batches(pending, schema), row_group_size=pending_rows)
+    writer.close()
+    yield sink.drain()
+
+
+def feather_chunks(chunks, compression=None):
+    """
+    Encode row chunks as an Arrow IPC file (Feather v2), one record batch per chunk.
+    """
+    import pyarrow as pa
+
+    schema = arrow_schema()
+    sink = ChunkSink()
+    options = pa.ipc.IpcWriteOptions(compression=None if compression in (None, "uncompressed") else compression)
+    writer = pa.ipc.new_file(sink, schema, options=options)
+    for rows in chunks:
+        if rows:
+            writer.write_batch(arrow_batch(rows, schema))
+            yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+EXPORT_FORMATS = {
+    "csv": (csv_chunks, "text/csv", "csv", None),
+    "json": (json_chunks, "application/json", "json", None),
+    "parquet": (parquet_chunks, "application/vnd.apache.parquet", "parquet", ("snappy", "zstd", "gzip", "brotli", "lz4", "none")),
+    "feather": (feather_chunks, "application/vnd.apache.arrow.file", "feather", ("lz4", "zstd", "uncompressed")),
+}
+EXPORT_FORMATS["arrow"] = EXPORT_FORMATS["feather"]
+
+export_cache = ExportCache(EXPORT_CACHE_MAX_BYTES, EXPORT_CACHE_ENTRY_MAX_BYTES)
+
+
+def export_cache_stats():
+    return export_cache.stats()
+
+
+def cache_export(body, key, version, media_type, headers):
+    """
+    Pass `body` through while keeping a copy, stored in the export cache once the
+    export completes. Copies larger than EXPORT_CACHE_ENTRY_MAX_BYTES are dropped.
+    """
+    parts = []
+    size = 0
+    for chunk in body:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if parts is not None:
+            size += len(chunk)
+            if size > EXPORT_CACHE_ENTRY_MAX_BYTES:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        export_cache.set(key, version, b"".join(parts), media_type, headers)
+
+
+def download(format, compress=False, compression=None, location=None, country=None, start_date=None, end_date=None,
+             if_none_match=None):
+    """
+    Stream records as CSV, a JSON array, Parquet or Arrow IPC (Feather).
+
+    CSV and JSON can be gzip-compressed with `compress`; the columnar formats take a
+    codec name in `compression` instead. Accepts the same filters as `read`.
+
+    Responses carry an ETag derived from the data version and the request, and a
+    matching `if_none_match` gets a 304. Completed exports are kept in memory and
+    served again without querying until the data changes.
+    """
+    format = format.lower()
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Use 'csv', 'json', 'parquet' or 'feather'.")
+    encoder, media_type, extension, codecs = EXPORT_FORMATS[format]
+    filename = f"weather_data.{extension}"
+
+    if codecs is None:
+        if compression:
+            raise HTTPException(status_code=400, detail=f"'compression' is not supported for {format}; use gzip=true.")
+    else:
+        if compress:
+            raise HTTPException(status_code=400, detail=f"gzip is not supported for {format}; use 'compression'.")
+        if compression and compression.lower() not in codecs:
+            raise HTTPException(status_code=400, detail=f"Invalid compression. Use one of: {', '.join(codecs)}.")
+        if importlib.util.find_spec("pyarrow") is None:
+            raise HTTPException(status_code=400, detail=f"The {format} format requires pyarrow to be installed.")
+        encoder = functools.partial(encoder, compression=compression.lower() if compression else None)
+
+    if compress:
+        media_type = "application/gzip"
+        filename += ".gz"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    key = (extension, compress, compression and compression.lower(), location, country, start_date, end_date)
+    version = data_version()
+    if version is not None:
+        headers["ETag"] = make_etag(version, *key)
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers={"ETag": headers["ETag"]})
+        cached = export_cache.get(key, version)
+        if cached is not None:
+            content, media_type, headers = cached
+            return Response(content, media_type=media_type, headers=headers)
+
+    conditions, params = build_filters(location, country, start_date, end_date)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    try:
+        chunks = stream_record_chunks(f"SELECT {', '.join(COLUMNS)} FROM weather_data {where} ORDER BY id;", params)
+        # Run the query before the response starts so database errors still map to a 500.
+        first = next(chunks, [])
+        body = encoder(itertools.chain([first], chunks))
+        if compress:
+            body = gzip_chunks(body)
+        if version is not None:
+            body = cache_export(body, key, version, media_type, headers)
+
+        return StreamingResponse(body, media_type=media_type, headers=headers)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during data download: {e}")
@@ -0,0 +1,26 @@
+import json
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """
+    Encode `content` as compact JSON bytes, with orjson when it is installed.
+
+    Datetimes are written in ISO 8601 like FastAPI's default encoder does, and
+    tuples are written as arrays, so row tuples can be encoded as they come
+    from the database.
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, separators=(",", ":"), allow_nan=False).encode()
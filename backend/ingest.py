@@ -0,0 +1,174 @@
+"""
+Bulk-load historical weather records from CSV or JSONL files.
+
+Rows are streamed into a temporary staging table with COPY and merged into
+weather_data in the same transaction, skipping (location, date) pairs that are
+already stored. On a partitioned table, monthly partitions are created from the
+oldest staged date first (in a separate, short transaction), so history does not
+pile up in the default partition.
+
+By default the load is logged to the change feed as a single `reset` event rather
+than one event (with a copy of the row) per record, which would roughly double
+the write volume of a backfill. Pass --capture-changes to log every record.
+
+Usage:
+    python -m backend.ingest history.csv
+    python -m backend.ingest history.jsonl --format jsonl
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from backend.database import COLUMNS, create_table_if_not_exists, get_connection
+from backend.partitions import ensure_partitions, is_partitioned
+
+INGEST_COLUMNS = COLUMNS[1:]
+JSONL_BATCH_SIZE = 10000
+
+
+class IteratorReader(io.RawIOBase):
+    """
+    Minimal file-like object over an iterator of strings, as expected by COPY FROM STDIN.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b""
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) - self._offset < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer = self._buffer[self._offset:] + chunk.encode()
+            self._offset = 0
+        end = len(self._buffer) if size < 0 else self._offset + size
+        data = self._buffer[self._offset:end]
+        self._offset = min(end, len(self._buffer))
+        return data
+
+
+def jsonl_to_csv(lines):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    batch = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        writer.writerow([record.get(column) for column in INGEST_COLUMNS])
+        batch += 1
+        if batch >= JSONL_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            batch = 0
+    yield buffer.getvalue()
+
+
+def create_partitions(first):
+    """
+    Create monthly partitions back to `first` in their own short transaction.
+    CREATE TABLE ... PARTITION OF locks weather_data exclusively, which must not
+    be held for the whole merge.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        ensure_partitions(cursor, first_month=first)
+        connection.commit()
+        cursor.close()
+
+
+def ingest_file(file, format="csv", capture_changes=False):
+    """
+    Load records from an open text file in `csv` (with a header row) or `jsonl` format.
+
+    CSV headers may use any subset and order of the weather_data columns but must
+    include `location` and `date`; an `id` column is ignored. Unless
+    `capture_changes` is set, change feed clients get one reset event instead of
+    one event per record. Returns the number of staged rows and the number of
+    rows inserted into weather_data.
+    """
+    if format == "csv":
+        header = next(csv.reader([file.readline()]))
+        header = [column.strip() for column in header]
+        unknown = set(header) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns in CSV header: {', '.join(sorted(unknown))}")
+        if not {"location", "date"} <= set(header):
+            raise ValueError("CSV header must include 'location' and 'date'.")
+        copy_columns = header
+        source = file
+    elif format == "jsonl":
+        copy_columns = INGEST_COLUMNS
+        source = IteratorReader(jsonl_to_csv(file))
+    else:
+        raise ValueError("Invalid format. Use 'csv' or 'jsonl'.")
+
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE weather_staging (
+                id BIGINT,
+                location VARCHAR(255),
+                region VARCHAR(255),
+                country VARCHAR(255),
+                condition VARCHAR(255),
+                temperature_c FLOAT,
+                wind_speed_kph FLOAT,
+                precipitation_mm FLOAT,
+                date TIMESTAMP
+            ) ON COMMIT DROP;
+        """)
+        cursor.copy_expert(
+            f"COPY weather_staging ({', '.join(copy_columns)}) FROM STDIN WITH (FORMAT csv)",
+            source,
+        )
+        staged = cursor.rowcount
+        if not capture_changes:
+            cursor.execute("SET LOCAL weather.skip_changes = 'on';")
+        if is_partitioned(cursor):
+            cursor.execute("SELECT min(date) FROM weather_staging;")
+            first = cursor.fetchone()[0]
+            if first is not None:
+                create_partitions(first)
+        cursor.execute(f"""
+            INSERT INTO weather_data ({', '.join(INGEST_COLUMNS)})
+            SELECT DISTINCT ON (location, date) {', '.join(INGEST_COLUMNS)}
+            FROM weather_staging
+            WHERE location IS NOT NULL AND date IS NOT NULL
+            ON CONFLICT (location, date) DO NOTHING;
+        """)
+        inserted = cursor.rowcount
+        connection.commit()
+        cursor.close()
+
+    return {"staged": staged, "inserted": inserted}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load weather records into PostgreSQL via COPY.")
+    parser.add_argument("path", help="CSV (with header) or JSONL file to load")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    parser.add_argument("--capture-changes", action="store_true",
+                        help="log every record to the change feed instead of one reset event")
+    args = parser.parse_args()
+
+    format = args.format or ("jsonl" if os.path.splitext(args.path)[1].lower() in (".jsonl", ".ndjson") else "csv")
+    create_table_if_not_exists()
+    started = time.perf_counter()
+    with open(args.path, newline="", encoding="utf-8") as file:
+        result = ingest_file(file, format, args.capture_changes)
+    elapsed = time.perf_counter() - started
+    print(f"Staged {result['staged']} rows, inserted {result['inserted']} new records in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+logger = logging.getLogger("backend")
+
+# Per-request {stage: seconds} breakdown used for slow-request logging.
+current_stages = contextvars.ContextVar("current_stages", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                labels = _format_labels(self.labels, label_values)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = _format_labels(self.labels, label_values, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+request_duration = Histogram(
+    "weather_http_request_duration_seconds", "Time spent handling HTTP requests.", ("method", "endpoint")
+)
+responses_total = Counter(
+    "weather_http_responses_total", "HTTP responses by status code.", ("method", "endpoint", "status")
+)
+stage_duration = Histogram(
+    "weather_stage_duration_seconds", "Time spent in each stage of request handling.", ("stage",)
+)
+rows_returned = Histogram(
+    "weather_rows_returned", "Rows returned per request.", ("endpoint",), buckets=ROW_BUCKETS
+)
+errors_total = Counter(
+    "weather_errors_total", "Errors raised, by exception type and where they were caught.", ("type", "where")
+)
+
+_collectors = []
+
+
+def register_collector(prefix, collect):
+    """
+    Expose the numeric values of `collect()` (a dict) as gauges named `<prefix>_<key>`.
+    """
+    _collectors.append((prefix, collect))
+
+
+def record_stage(stage, seconds):
+    if not METRICS_ENABLED:
+        return
+    stage_duration.observe(seconds, stage)
+    stages = current_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage):
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def record_rows(endpoint, count):
+    if METRICS_ENABLED:
+        rows_returned.observe(count, endpoint)
+
+
+def record_error(error, where):
+    """
+    Count and log an exception that is handled rather than propagated.
+    """
+    if METRICS_ENABLED:
+        errors_total.inc(type(error).__name__, where)
+    logger.error("%s failed: %r", where, error)
+
+
+async def track_request(request, call_next):
+    """
+    HTTP middleware recording per-endpoint latency and status codes, and logging a
+    per-stage breakdown for requests slower than SLOW_REQUEST_MS.
+    """
+    stages = {}
+    token = current_stages.set(stages)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        current_stages.reset(token)
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        request_duration.observe(elapsed, request.method, endpoint)
+        responses_total.inc(request.method, endpoint, str(status))
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            breakdown = ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in stages.items())
+            logger.warning(
+                "Slow request %s %s: %.1fms (%s)",
+                request.method, request.url.path, elapsed * 1000, breakdown or "no stages recorded",
+            )
+
+
+def render():
+    lines = []
+    for metric in (request_duration, responses_total, stage_duration, rows_returned, errors_total):
+        lines.extend(metric.render())
+    for prefix, collect in _collectors:
+        for key, value in collect().items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                name = f"weather_{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
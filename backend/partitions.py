@@ -0,0 +1,296 @@
+"""
+Monthly range partitioning, retention and compaction for weather_data.
+
+With WEATHER_PARTITIONING enabled, weather_data is created as a table partitioned
+by `date` with one partition per month (weather_data_pYYYYMM) plus a default
+partition, and the backend periodically:
+
+- drops partitions older than RETENTION_MONTHS (whole tables, no row deletes)
+  and deletes rows older than that from the default partition,
+- creates partitions PARTITION_MONTHS_AHEAD months ahead of the current month,
+  plus one for every month that has rows in the default partition (e.g. rows
+  dated further ahead), moving those rows into it,
+- downsamples readings older than COMPACT_AFTER_DAYS to hourly averages.
+
+Dropping or compacting raw readings leaves the weather_daily rollups untouched.
+They become approximate, though, once a compacted day is written to again: any
+update or delete there recomputes the day from its hourly averages, which lowers
+`readings` and narrows the min and max.
+Retention and compaction that change rows post a single `reset` event to the change
+feed instead of one event per row.
+
+`date` is part of the partitioned table's primary key and so cannot be NULL. `migrate`
+refuses to convert a table that has rows without a date and leaves it unchanged; delete
+or backfill those rows first.
+
+Usage:
+    python -m backend.partitions migrate     # convert an existing plain table
+    python -m backend.partitions maintain    # run one maintenance pass
+"""
+import argparse
+import os
+from datetime import date, datetime, timedelta
+from dotenv import load_dotenv
+from backend.database import COLUMNS, get_connection, create_table_if_not_exists
+from backend.metrics import record_error
+
+load_dotenv()
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+RETENTION_MONTHS = int(os.getenv("RETENTION_MONTHS", "0"))
+COMPACT_AFTER_DAYS = int(os.getenv("COMPACT_AFTER_DAYS", "0"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+PARTITIONED_TABLE_DDL = """
+CREATE SEQUENCE IF NOT EXISTS weather_data_id_seq;
+CREATE TABLE weather_data (
+    id INTEGER NOT NULL DEFAULT nextval('weather_data_id_seq'),
+    location VARCHAR(255),
+    region VARCHAR(255),
+    country VARCHAR(255),
+    condition VARCHAR(255),
+    temperature_c FLOAT,
+    wind_speed_kph FLOAT,
+    precipitation_mm FLOAT,
+    date TIMESTAMP,
+    CONSTRAINT weather_data_pkey PRIMARY KEY (id, date),
+    CONSTRAINT weather_data_location_date_key UNIQUE (location, date)
+) PARTITION BY RANGE (date);
+ALTER SEQUENCE weather_data_id_seq OWNED BY weather_data.id;
+CREATE TABLE weather_data_default PARTITION OF weather_data DEFAULT;
+"""
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"weather_data_p{month:%Y%m}"
+
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('weather_data');")
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def create_partitioned_table(cursor):
+    cursor.execute(PARTITIONED_TABLE_DDL)
+    ensure_partitions(cursor)
+
+
+def ensure_partitions(cursor, first_month=None, months_ahead=None):
+    """
+    Create monthly partitions from `first_month` (default: this month) through
+    `months_ahead` months after the current month, and for every month that has
+    rows in the default partition. Returns the names created.
+    """
+    months_ahead = PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current = month_start(date.today())
+    month = month_start(first_month) if first_month else current
+    last = add_months(current, months_ahead)
+    months = set()
+    while month <= last:
+        months.add(month)
+        month = add_months(month, 1)
+    cursor.execute("SELECT DISTINCT date_trunc('month', date)::date FROM weather_data_default;")
+    stranded = {row[0] for row in cursor.fetchall()}
+
+    created = []
+    for month in sorted(months | stranded):
+        name = partition_name(month)
+        cursor.execute("SELECT to_regclass(%s);", (name,))
+        if cursor.fetchone()[0] is not None:
+            continue
+        bounds = (month, add_months(month, 1))
+        if month in stranded:
+            # The new partition cannot be attached while the default partition holds
+            # rows in its range. Rows are moved partition to partition, which fires
+            # no weather_data triggers: the table's contents do not change.
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS weather_data_moving (LIKE weather_data) ON COMMIT DROP;
+                WITH moved AS (
+                    DELETE FROM weather_data_default WHERE date >= %s AND date < %s RETURNING *
+                )
+                INSERT INTO weather_data_moving SELECT * FROM moved;
+            """, bounds)
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF weather_data FOR VALUES FROM (%s) TO (%s);", bounds)
+        if month in stranded:
+            cursor.execute(f"""
+                INSERT INTO {name} SELECT * FROM weather_data_moving;
+                TRUNCATE weather_data_moving;
+            """)
+        created.append(name)
+    return created
+
+
+def list_partitions(cursor):
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'weather_data'::regclass AND c.relname ~ '^weather_data_p[0-9]{6}$'
+        ORDER BY c.relname;
+    """)
+    return [(name, datetime.strptime(name[-6:], "%Y%m").date()) for (name,) in cursor.fetchall()]
+
+
+def apply_retention(cursor, retention_months=None):
+    """
+    Drop monthly partitions whose whole range is older than `retention_months` and
+    delete older rows from the default partition. Returns the dropped partition
+    names and the number of rows deleted from the default partition.
+    """
+    retention_months = RETENTION_MONTHS if retention_months is None else retention_months
+    if retention_months <= 0:
+        return [], 0
+    cutoff = add_months(month_start(date.today()), -retention_months)
+    dropped = []
+    for name, month in list_partitions(cursor):
+        if add_months(month, 1) <= cutoff:
+            cursor.execute(f"DROP TABLE {name};")
+            dropped.append(name)
+    cursor.execute("DELETE FROM weather_data_default WHERE date < %s;", (cutoff,))
+    expired = cursor.rowcount
+    if dropped or expired:
+        # Neither statement runs the weather_data triggers, so bump the data
+        # version here (cached exports and ETags must not outlive the rows) and
+        # tell change feed clients to re-read rather than logging every row.
+        cursor.execute("UPDATE weather_data_version SET version = version + 1;")
+        cursor.execute("SELECT weather_changes_reset();")
+    return dropped, expired
+
+
+def compact(cursor, older_than_days=None):
+    """
+    Replace readings older than `older_than_days` with one row per location and hour.
+
+    Temperature, wind and precipitation are averaged and the most frequent condition
+    is kept. Hours that already hold a single reading are left alone. Returns the
+    number of raw rows that were merged. The day's rollup keeps the original
+    aggregates until a later write to that day recomputes it from the averages.
+    """
+    older_than_days = COMPACT_AFTER_DAYS if older_than_days is None else older_than_days
+    if older_than_days <= 0:
+        return 0
+    cutoff = datetime.combine(date.today() - timedelta(days=older_than_days), datetime.min.time())
+    # Rollups keep the aggregates of the original readings, and the change feed
+    # gets one reset rather than a delete and an insert event per row.
+    cursor.execute("SET LOCAL weather.skip_rollups = 'on';")
+    cursor.execute("SET LOCAL weather.skip_changes = 'on';")
+    cursor.execute("""
+        WITH hours AS (
+            SELECT location, date_trunc('hour', date) AS hour
+            FROM weather_data
+            WHERE date < %(cutoff)s AND location IS NOT NULL
+            GROUP BY location, date_trunc('hour', date)
+            HAVING count(*) > 1
+        ), merged AS (
+            DELETE FROM weather_data w
+            USING hours h
+            WHERE w.location = h.location AND w.date >= h.hour AND w.date < h.hour + interval '1 hour'
+              AND w.date < %(cutoff)s
+            RETURNING w.*
+        ), inserted AS (
+            INSERT INTO weather_data (location, region, country, condition, temperature_c, wind_speed_kph, precipitation_mm, date)
+            SELECT location, max(region), max(country), mode() WITHIN GROUP (ORDER BY condition),
+                   avg(temperature_c), avg(wind_speed_kph), avg(precipitation_mm), date_trunc('hour', date)
+            FROM merged
+            GROUP BY location, date_trunc('hour', date)
+        )
+        SELECT count(*) FROM merged;
+    """, {"cutoff": cutoff})
+    merged = cursor.fetchone()[0]
+    return merged
+
+
+def maintain():
+    """
+    Run one maintenance pass: create upcoming partitions, apply retention and compact.
+    """
+    try:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            if not is_partitioned(cursor):
+                cursor.close()
+                return {"message": "weather_data is not partitioned; run `python -m backend.partitions migrate`."}
+            # Retention first, so no partitions are created for expired months.
+            dropped, expired = apply_retention(cursor)
+            created = ensure_partitions(cursor)
+            connection.commit()
+            compacted = compact(cursor)
+            connection.commit()
+            cursor.close()
+        return {"created": created, "dropped": dropped, "expired_default_rows": expired, "compacted_rows": compacted}
+    except Exception as e:
+        record_error(e, "maintain_partitions")
+
+
+def migrate():
+    """
+    Convert an existing plain weather_data table into the partitioned layout in one
+    transaction. Ids, the id sequence and the weather_daily rollups are preserved.
+    Nothing is changed if any row has a NULL date.
+    """
+    columns = ", ".join(COLUMNS)
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT to_regclass('weather_data');")
+        if cursor.fetchone()[0] is None or is_partitioned(cursor):
+            cursor.close()
+            connection.rollback()
+            create_table_if_not_exists()
+            return {"migrated_rows": 0}
+
+        cursor.execute("LOCK TABLE weather_data IN ACCESS EXCLUSIVE MODE;")
+        cursor.execute("SELECT count(*) FROM weather_data WHERE date IS NULL;")
+        undated = cursor.fetchone()[0]
+        if undated:
+            cursor.close()
+            connection.rollback()
+            return {"message": f"weather_data has {undated} rows without a date, which the partitioned "
+                               "table cannot hold. Delete or backfill them "
+                               "(e.g. `DELETE FROM weather_data WHERE date IS NULL;`) and migrate again."}
+        cursor.execute("""
+            ALTER TABLE weather_data RENAME TO weather_data_legacy;
+            ALTER TABLE weather_data_legacy RENAME CONSTRAINT weather_data_pkey TO weather_data_legacy_pkey;
+            ALTER TABLE weather_data_legacy DROP CONSTRAINT IF EXISTS weather_data_location_date_key;
+            DROP INDEX IF EXISTS weather_data_date_id_idx;
+            DROP INDEX IF EXISTS weather_data_country_idx;
+            DROP TRIGGER IF EXISTS weather_daily_insert ON weather_data_legacy;
+            DROP TRIGGER IF EXISTS weather_daily_delete ON weather_data_legacy;
+            DROP TRIGGER IF EXISTS weather_daily_update ON weather_data_legacy;
+            ALTER TABLE weather_data_legacy ALTER COLUMN id DROP DEFAULT;
+            ALTER SEQUENCE weather_data_id_seq OWNED BY NONE;
+        """)
+        cursor.execute("SELECT min(date) FROM weather_data_legacy;")
+        first = cursor.fetchone()[0]
+        cursor.execute(PARTITIONED_TABLE_DDL)
+        ensure_partitions(cursor, first_month=first)
+        cursor.execute(f"INSERT INTO weather_data ({columns}) SELECT {columns} FROM weather_data_legacy;")
+        migrated = cursor.rowcount
+        cursor.execute("DROP TABLE weather_data_legacy;")
+        connection.commit()
+        cursor.close()
+
+    create_table_if_not_exists(force=True)
+    return {"migrated_rows": migrated}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage weather_data partitions.")
+    parser.add_argument("command", choices=["migrate", "maintain"])
+    args = parser.parse_args()
+    if args.command == "migrate":
+        print(migrate())
+    else:
+        print(maintain())
+
+
+if __name__ == "__main__":
+    main()
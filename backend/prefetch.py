@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from backend.metrics import record_error, record_stage
+
+
+class PrefetchScheduler:
+    """
+    Keeps the most requested locations warm in the weather cache.
+
+    Every `get_weather` call bumps a popularity score for its normalized location,
+    which decays by `decay` each pass. Only locations whose score is at least
+    `min_score`, i.e. that are still being requested, are prefetched; how often
+    each was stored over the last `history_days` days (reloaded every
+    `history_interval` seconds) only ranks them. Each pass refreshes the top
+    `top_n` of those whose cache entry is missing or expires within `lead`
+    seconds, calling the upstream at most `rate` times per second in this process.
+
+    `refresh` should not store its results: stored records feed the history, and
+    a location must not stay popular just because it is being prefetched.
+    """
+
+    def __init__(self, cache, refresh, history, top_n, interval, lead, rate,
+                 decay=0.9, min_score=0.5, history_days=7, history_interval=600, max_tracked=10000):
+        self.cache = cache
+        self.refresh = refresh
+        self.history = history
+        self.top_n = top_n
+        self.interval = interval
+        self.lead = lead
+        self.rate = rate
+        self.decay = decay
+        self.min_score = min_score
+        self.history_days = history_days
+        self.history_interval = history_interval
+        self.max_tracked = max_tracked
+        self._scores = {}
+        self._history = {}
+        self._history_loaded_at = None
+        self._lock = threading.Lock()
+        self._task = None
+        self.passes = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped_fresh = 0
+        self.last_pass_s = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def track(self, key):
+        """
+        Count a request for `key`. Ignored while the scheduler is not running, since
+        scores are only decayed and trimmed by its passes.
+        """
+        if self._task is None:
+            return
+        with self._lock:
+            self._scores[key] = self._scores.get(key, 0.0) + 1.0
+            # Bound memory between passes too, e.g. under a flood of distinct locations.
+            if len(self._scores) > 2 * self.max_tracked:
+                self._trim()
+
+    def forget(self, key):
+        with self._lock:
+            self._scores.pop(key, None)
+            self._history.pop(key, None)
+
+    def hot_locations(self):
+        """
+        Return the `top_n` location keys with a request score of at least
+        `min_score`, ranked by that score plus their stored-history share.
+        """
+        with self._lock:
+            ranked = {
+                key: score + self._history.get(key, 0.0)
+                for key, score in self._scores.items()
+                if score >= self.min_score
+            }
+        return sorted(ranked, key=ranked.get, reverse=True)[:self.top_n]
+
+    def _trim(self):
+        if len(self._scores) > self.max_tracked:
+            keep = sorted(self._scores, key=self._scores.get, reverse=True)[:self.max_tracked]
+            self._scores = {key: self._scores[key] for key in keep}
+
+    def _decay(self):
+        with self._lock:
+            self._scores = {key: score * self.decay for key, score in self._scores.items() if score * self.decay >= 0.01}
+            self._trim()
+
+    async def _load_history(self):
+        now = time.monotonic()
+        if self._history_loaded_at is not None and now - self._history_loaded_at < self.history_interval:
+            return
+        self._history_loaded_at = now
+        rows = await run_in_threadpool(self.history, self.history_days, self.top_n)
+        total = sum(readings for _, readings in rows) or 1
+        # Stored rows only rank locations that are still requested, with a total weight of one request.
+        history = {}
+        for location, readings in rows:
+            key = " ".join(location.split()).lower()
+            history[key] = history.get(key, 0.0) + readings / total
+        with self._lock:
+            self._history = history
+
+    async def run_once(self):
+        started = time.monotonic()
+        await self._load_history()
+        spacing = 1.0 / self.rate if self.rate > 0 else 0.0
+        next_call = time.monotonic()
+        for key in self.hot_locations():
+            remaining = self.cache.ttl_remaining(key)
+            if remaining is not None and remaining > self.lead:
+                self.skipped_fresh += 1
+                continue
+            delay = next_call - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_call = max(next_call, time.monotonic()) + spacing
+            try:
+                self.cache.set(key, await self.refresh(key))
+                self.refreshed += 1
+            except HTTPException as e:
+                self.failed += 1
+                if e.status_code == 404:
+                    self.forget(key)
+            except Exception as e:
+                self.failed += 1
+                record_error(e, "prefetch")
+        self._decay()
+        self.passes += 1
+        self.last_pass_s = time.monotonic() - started
+        record_stage("prefetch_pass", self.last_pass_s)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                record_error(e, "prefetch_pass")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self._scores)
+            history = len(self._history)
+        return {
+            "running": self.running,
+            "tracked": tracked,
+            "history_locations": history,
+            "top_n": self.top_n,
+            "rate_per_s": self.rate,
+            "passes": self.passes,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "skipped_fresh": self.skipped_fresh,
+            "last_pass_s": round(self.last_pass_s, 6),
+        }
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import random
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WEATHER_API_CONNECT_TIMEOUT = float(os.getenv("WEATHER_API_CONNECT_TIMEOUT", "3"))
+WEATHER_API_READ_TIMEOUT = float(os.getenv("WEATHER_API_READ_TIMEOUT", "10"))
+WEATHER_API_CONCURRENCY = int(os.getenv("WEATHER_API_CONCURRENCY", "20"))
+WEATHER_API_RETRIES = int(os.getenv("WEATHER_API_RETRIES", "2"))
+WEATHER_API_BACKOFF = float(os.getenv("WEATHER_API_BACKOFF", "0.2"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpstreamClient:
+    """
+    Shared async HTTP client for third-party APIs.
+
+    Keeps one keep-alive connection pool for the whole process, caps the number of
+    in-flight upstream requests and retries transient failures (timeouts, connection
+    errors, 429/5xx) with exponential backoff and full jitter.
+    """
+
+    def __init__(self, connect_timeout, read_timeout, concurrency, retries, backoff):
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self._client = None
+        self._semaphore = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    async def get(self, url, params=None):
+        """
+        GET `url` and return the response. Only the last failed attempt is raised.
+        """
+        await self.start()
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    response = await self._client.get(url, params=params)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    return response
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+
+weather_client = UpstreamClient(
+    WEATHER_API_CONNECT_TIMEOUT,
+    WEATHER_API_READ_TIMEOUT,
+    WEATHER_API_CONCURRENCY,
+    WEATHER_API_RETRIES,
+    WEATHER_API_BACKOFF,
+)
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from fastapi.concurrency import run_in_threadpool
+from backend.metrics import record_error, record_stage
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-process queue that persists records in the background.
+
+    A single drain task collects up to `batch_size` records, or whatever arrived
+    within `flush_interval` seconds of the first one, and hands them to `save_many`
+    in one call. When the queue is full, `put` waits up to `put_timeout` seconds for
+    room (backpressure) and then saves the record synchronously instead of dropping it.
+
+    A batch that fails to save (`save_many` raises or returns None) is retried with
+    exponential backoff from `retry_delay` up to `max_retry_delay` seconds, holding
+    back later records meanwhile. `stop` waits up to `stop_timeout` seconds for the
+    queue to drain, then makes one last synchronous attempt with whatever is left.
+    """
+
+    def __init__(self, save_many, max_size, batch_size, flush_interval, put_timeout,
+                 retry_delay=0.5, max_retry_delay=30, stop_timeout=30):
+        self.save_many = save_many
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.stop_timeout = stop_timeout
+        self._queue = None
+        self._task = None
+        self._pending = []
+        self.enqueued = 0
+        self.backpressure_waits = 0
+        self.overflow_saves = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.retried_rows = 0
+        self.failed_rows = 0
+        self.max_depth = 0
+        self.last_flush_s = 0.0
+        self.max_flush_s = 0.0
+        self._flush_total = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(self.max_size)
+            self._task = asyncio.create_task(self._drain())
+
+    async def stop(self):
+        """
+        Stop the drain task after flushing everything that is still queued.
+        """
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        try:
+            await asyncio.wait_for(self._queue.join(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            pass
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        remaining, self._pending = self._pending, []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+            self._queue.task_done()
+        if not remaining:
+            return
+        # Saves skip records already stored, so re-sending a batch that was
+        # still being written when the task was cancelled is harmless.
+        result = None
+        try:
+            result = await run_in_threadpool(self.save_many, remaining)
+        except Exception as e:
+            record_error(e, "write_behind_stop")
+        if result is None:
+            self.failed_rows += len(remaining)
+        else:
+            self.flushed_rows += len(remaining)
+
+    async def put(self, record):
+        if self._queue.full():
+            self.backpressure_waits += 1
+            try:
+                await asyncio.wait_for(self._queue.put(record), self.put_timeout)
+            except asyncio.TimeoutError:
+                self.overflow_saves += 1
+                await run_in_threadpool(self.save_many, [record])
+                return
+        else:
+            self._queue.put_nowait(record)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    async def _drain(self):
+        while True:
+            # Records count as pending from the moment they leave the queue, so
+            # stop() also saves a batch that was still being collected.
+            self._pending = batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+            self._pending = []
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch):
+        delay = self.retry_delay
+        while True:
+            started = time.monotonic()
+            result = None
+            try:
+                result = await run_in_threadpool(self.save_many, batch)
+            except Exception as e:
+                record_error(e, "write_behind_flush")
+            elapsed = time.monotonic() - started
+            record_stage("write_behind_flush", elapsed)
+            if result is not None:
+                break
+            self.failed_flushes += 1
+            self.retried_rows += len(batch)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+        self.flushes += 1
+        self.flushed_rows += len(batch)
+        self.last_flush_s = elapsed
+        self.max_flush_s = max(self.max_flush_s, elapsed)
+        self._flush_total += elapsed
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_size": self.max_size,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "backpressure_waits": self.backpressure_waits,
+            "overflow_saves": self.overflow_saves,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "retried_rows": self.retried_rows,
+            "failed_rows": self.failed_rows,
+            "last_flush_s": round(self.last_flush_s, 6),
+            "avg_flush_s": round(self._flush_total / self.flushes, 6) if self.flushes else 0.0,
+            "max_flush_s": round(self.max_flush_s, 6),
+        }
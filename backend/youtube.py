@@ -0,0 +1,314 @@
+"""
+YouTube search proxy with a persistent cache and daily quota accounting.
+
+Search results are stored in the youtube_cache table, so every backend worker and
+every frontend instance shares them for YOUTUBE_CACHE_TTL seconds. Refreshing an
+entry takes a short lease on its row, which keeps concurrent workers from searching
+for the same query twice, and reserves YOUTUBE_SEARCH_COST quota units for the
+current quota day (midnight to midnight Pacific time, as YouTube counts it). Once
+YOUTUBE_DAILY_QUOTA units are spent, or YouTube reports the quota as exceeded,
+expired results are served as stale instead of failing.
+"""
+import asyncio
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from backend.cache import TTLCache
+from backend.database import get_connection
+from backend.metrics import record_error, timed
+from backend.upstream import UpstreamClient
+
+load_dotenv()
+
+YOUTUBE_API_KEY = os.getenv("YT_API_KEY")
+YOUTUBE_API_URL = os.getenv("YOUTUBE_API_URL", "https://www.googleapis.com/youtube/v3/search")
+YOUTUBE_CACHE_TTL = float(os.getenv("YOUTUBE_CACHE_TTL", "21600"))
+YOUTUBE_MEMORY_TTL = float(os.getenv("YOUTUBE_MEMORY_TTL", "60"))
+YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))
+YOUTUBE_SEARCH_COST = int(os.getenv("YOUTUBE_SEARCH_COST", "100"))
+YOUTUBE_MAX_RESULTS = int(os.getenv("YOUTUBE_MAX_RESULTS", "5"))
+YOUTUBE_LEASE_SECONDS = float(os.getenv("YOUTUBE_LEASE_SECONDS", "15"))
+YOUTUBE_API_CONNECT_TIMEOUT = float(os.getenv("YOUTUBE_API_CONNECT_TIMEOUT", "3"))
+YOUTUBE_API_READ_TIMEOUT = float(os.getenv("YOUTUBE_API_READ_TIMEOUT", "10"))
+YOUTUBE_API_CONCURRENCY = int(os.getenv("YOUTUBE_API_CONCURRENCY", "5"))
+YOUTUBE_API_RETRIES = int(os.getenv("YOUTUBE_API_RETRIES", "1"))
+YOUTUBE_API_BACKOFF = float(os.getenv("YOUTUBE_API_BACKOFF", "0.5"))
+
+# YouTube resets quotas at midnight Pacific time.
+QUOTA_DAY = "(now() AT TIME ZONE 'America/Los_Angeles')::date"
+
+YOUTUBE_SCHEMA = """
+SELECT pg_advisory_xact_lock(hashtext('youtube_schema'));
+CREATE TABLE IF NOT EXISTS youtube_cache (
+    query TEXT PRIMARY KEY,
+    items JSONB,
+    fetched_at TIMESTAMPTZ,
+    expires_at TIMESTAMPTZ,
+    refreshing_until TIMESTAMPTZ
+);
+CREATE TABLE IF NOT EXISTS youtube_quota (
+    day DATE PRIMARY KEY,
+    units_used INTEGER NOT NULL DEFAULT 0,
+    exhausted BOOLEAN NOT NULL DEFAULT false
+);
+"""
+
+youtube_client = UpstreamClient(
+    YOUTUBE_API_CONNECT_TIMEOUT,
+    YOUTUBE_API_READ_TIMEOUT,
+    YOUTUBE_API_CONCURRENCY,
+    YOUTUBE_API_RETRIES,
+    YOUTUBE_API_BACKOFF,
+)
+
+# Short-lived in-process layer; also coalesces concurrent requests within a worker.
+memory_cache = TTLCache(YOUTUBE_MEMORY_TTL, 1024)
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"cache_hits": 0, "upstream_searches": 0, "stale_served": 0, "lease_waits": 0, "quota_rejections": 0}
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def normalize_query(query):
+    return " ".join(query.split()).lower()
+
+
+def create_youtube_tables():
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(YOUTUBE_SCHEMA)
+            connection.commit()
+            cursor.close()
+        _schema_ready = True
+
+
+def read_cached(key):
+    """
+    Return `(items, fetched_at, fresh)` for a cached query, or None if never fetched.
+    """
+    create_youtube_tables()
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT items, fetched_at, expires_at > now() FROM youtube_cache WHERE query = %s AND items IS NOT NULL;",
+            (key,),
+        )
+        row = cursor.fetchone()
+        connection.commit()
+        cursor.close()
+    return row
+
+
+def claim_refresh(key):
+    """
+    Take the refresh lease for `key` and reserve quota for one search.
+
+    Returns False when another worker holds the lease or the cached results are
+    already fresh (another worker stored them since they were read). Raises QuotaExhausted
+    (without taking the lease) when today's budget cannot cover another search.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            INSERT INTO youtube_quota (day) VALUES ({QUOTA_DAY})
+            ON CONFLICT (day) DO NOTHING;
+            SELECT units_used, exhausted FROM youtube_quota WHERE day = {QUOTA_DAY} FOR UPDATE;
+        """)
+        units_used, exhausted = cursor.fetchone()
+        if exhausted or units_used + YOUTUBE_SEARCH_COST > YOUTUBE_DAILY_QUOTA:
+            connection.rollback()
+            cursor.close()
+            raise QuotaExhausted(f"YouTube quota exhausted ({units_used}/{YOUTUBE_DAILY_QUOTA} units used today).")
+
+        cursor.execute("""
+            INSERT INTO youtube_cache AS c (query, refreshing_until)
+            VALUES (%(query)s, now() + %(lease)s * interval '1 second')
+            ON CONFLICT (query) DO UPDATE SET refreshing_until = EXCLUDED.refreshing_until
+            WHERE (c.refreshing_until IS NULL OR c.refreshing_until < now())
+              AND (c.expires_at IS NULL OR c.expires_at <= now())
+            RETURNING query;
+        """, {"query": key, "lease": YOUTUBE_LEASE_SECONDS})
+        claimed = cursor.fetchone() is not None
+        if claimed:
+            cursor.execute(
+                f"UPDATE youtube_quota SET units_used = units_used + %s WHERE day = {QUOTA_DAY};",
+                (YOUTUBE_SEARCH_COST,),
+            )
+        connection.commit()
+        cursor.close()
+    return claimed
+
+
+def store_results(key, items):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""
+            UPDATE youtube_cache
+            SET items = %s, fetched_at = now(), expires_at = now() + %s * interval '1 second', refreshing_until = NULL
+            WHERE query = %s
+            RETURNING fetched_at;
+        """, (json.dumps(items), YOUTUBE_CACHE_TTL, key))
+        fetched_at = cursor.fetchone()[0]
+        connection.commit()
+        cursor.close()
+    return fetched_at
+
+
+def release_lease(key, quota_exceeded=False):
+    """
+    Give up the refresh lease for `key`. Failures are only recorded: the lease
+    expires after YOUTUBE_LEASE_SECONDS anyway.
+    """
+    try:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("UPDATE youtube_cache SET refreshing_until = NULL WHERE query = %s;", (key,))
+            if quota_exceeded:
+                cursor.execute(f"UPDATE youtube_quota SET exhausted = true WHERE day = {QUOTA_DAY};")
+            connection.commit()
+            cursor.close()
+    except Exception as e:
+        record_error(e, "youtube_release_lease")
+
+
+def quota_usage():
+    create_youtube_tables()
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT units_used, exhausted FROM youtube_quota WHERE day = {QUOTA_DAY};")
+        row = cursor.fetchone()
+        connection.commit()
+        cursor.close()
+    units_used, exhausted = row or (0, False)
+    return {"units_used": units_used, "daily_quota": YOUTUBE_DAILY_QUOTA, "exhausted": exhausted}
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def quota_exceeded(response):
+    if response.status_code != 403:
+        return False
+    try:
+        errors = response.json()["error"]["errors"]
+    except (ValueError, KeyError, TypeError):
+        return False
+    return any(error.get("reason") in ("quotaExceeded", "dailyLimitExceeded") for error in errors)
+
+
+async def search_upstream(key):
+    with timed("youtube_fetch"):
+        return await youtube_client.get(YOUTUBE_API_URL, params={
+            "part": "snippet",
+            "q": key + " weather",
+            "type": "video",
+            "key": YOUTUBE_API_KEY,
+            "maxResults": YOUTUBE_MAX_RESULTS,
+        })
+
+
+def serve_cached(key, cached):
+    _count("cache_hits")
+    items, fetched_at, _ = cached
+    return {"query": key, "items": items, "fetched_at": fetched_at, "stale": False}
+
+
+def serve_stale(key, cached, reason):
+    if cached is None:
+        raise HTTPException(status_code=503, detail=f"{reason} No cached results are available for '{key}'.")
+    _count("stale_served")
+    items, fetched_at, _ = cached
+    return {"query": key, "items": items, "fetched_at": fetched_at, "stale": True}
+
+
+async def load(key):
+    deadline = asyncio.get_running_loop().time() + YOUTUBE_LEASE_SECONDS
+    while True:
+        try:
+            cached = await run_in_threadpool(read_cached, key)
+        except Exception as e:
+            record_error(e, "youtube_read_cached")
+            raise HTTPException(status_code=500, detail="Failed to read cached YouTube results.")
+        if cached is not None and cached[2]:
+            return serve_cached(key, cached)
+
+        try:
+            claimed = await run_in_threadpool(claim_refresh, key)
+        except QuotaExhausted as e:
+            _count("quota_rejections")
+            return serve_stale(key, cached, str(e))
+        except Exception as e:
+            record_error(e, "youtube_claim_refresh")
+            return serve_stale(key, cached, "Failed to reserve a YouTube search.")
+        if claimed:
+            break
+        # Another worker is searching for this query or has just stored its results:
+        # serve those if they are fresh, else what we have, or wait for its result.
+        try:
+            cached = await run_in_threadpool(read_cached, key) or cached
+        except Exception as e:
+            record_error(e, "youtube_read_cached")
+        if cached is not None and cached[2]:
+            return serve_cached(key, cached)
+        _count("lease_waits")
+        if cached is not None or asyncio.get_running_loop().time() >= deadline:
+            return serve_stale(key, cached, "A search for this query is already in progress.")
+        await asyncio.sleep(0.2)
+
+    try:
+        response = await search_upstream(key)
+        if quota_exceeded(response):
+            await run_in_threadpool(release_lease, key, True)
+            _count("quota_rejections")
+            return serve_stale(key, cached, "YouTube reported the daily quota as exceeded.")
+        response.raise_for_status()
+        items = response.json().get("items", [])
+    except HTTPException:
+        raise
+    except Exception as e:
+        record_error(e, "youtube_search")
+        await run_in_threadpool(release_lease, key)
+        return serve_stale(key, cached, "YouTube search failed.")
+
+    _count("upstream_searches")
+    stored = False
+    try:
+        fetched_at = await run_in_threadpool(store_results, key, items)
+        stored = True
+    except Exception as e:
+        # The search already used its quota, so return its results even though
+        # other workers will not see them.
+        record_error(e, "youtube_store_results")
+        fetched_at = datetime.now(timezone.utc)
+    finally:
+        if not stored:
+            await run_in_threadpool(release_lease, key)
+    return {"query": key, "items": items, "fetched_at": fetched_at, "stale": False}
+
+
+async def search_videos(query):
+    """
+    Return YouTube search results for `query`, from the shared cache when possible.
+    """
+    key = normalize_query(query)
+    return await memory_cache.aget_or_load(key, lambda: load(key))
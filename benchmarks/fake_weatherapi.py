@@ -0,0 +1,74 @@
+"""
+Local stand-in for WeatherAPI's /v1/current.json (and YouTube's /youtube/v3/search)
+used by the benchmark suite.
+
+Latency and error rate are read from the environment:
+    FAKE_LATENCY_MS      mean response delay in milliseconds (default 50)
+    FAKE_JITTER_MS       uniform +/- jitter around the mean (default 10)
+    FAKE_ERROR_RATE      fraction of requests answered with a 503 (default 0)
+
+Run with:
+    uvicorn benchmarks.fake_weatherapi:app --port 8002
+"""
+import asyncio
+import os
+import random
+from datetime import datetime
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "50"))
+JITTER_MS = float(os.getenv("FAKE_JITTER_MS", "10"))
+ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+CONDITIONS = ["Sunny", "Partly cloudy", "Cloudy", "Light rain", "Heavy snow", "Mist", "Thundery outbreaks"]
+
+app = FastAPI()
+
+
+@app.get("/v1/current.json")
+async def current(q: str, key: str = None, aqi: str = "no"):
+    delay = max(LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS), 0) / 1000
+    await asyncio.sleep(delay)
+
+    if random.random() < ERROR_RATE:
+        return JSONResponse(status_code=503, content={"error": {"code": 9999, "message": "Internal application error."}})
+    if q.lower().startswith("nowhere"):
+        return JSONResponse(status_code=400, content={"error": {"code": 1006, "message": "No matching location found."}})
+
+    rng = random.Random(q)
+    return {
+        "location": {
+            "name": q.title(),
+            "region": f"{q.title()} Region",
+            "country": "Benchmarkland",
+            "localtime": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        },
+        "current": {
+            "temp_c": round(rng.uniform(-20, 40), 1),
+            "wind_kph": round(rng.uniform(0, 60), 1),
+            "precip_mm": round(rng.uniform(0, 20), 1),
+            "condition": {"text": rng.choice(CONDITIONS)},
+        },
+    }
+
+
+@app.get("/youtube/v3/search")
+async def youtube_search(q: str, key: str = None, part: str = "snippet", type: str = "video", maxResults: int = 5):
+    delay = max(LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS), 0) / 1000
+    await asyncio.sleep(delay)
+
+    if random.random() < ERROR_RATE:
+        return JSONResponse(status_code=503, content={"error": {"code": 503, "message": "Backend Error"}})
+
+    return {
+        "items": [
+            {
+                "id": {"videoId": f"{abs(hash((q, index))) % 10 ** 11:011d}"},
+                "snippet": {
+                    "title": f"{q.title()} #{index + 1}",
+                    "thumbnails": {"medium": {"url": "https://i.ytimg.com/vi/benchmark/mqdefault.jpg"}},
+                },
+            }
+            for index in range(maxResults)
+        ]
+    }
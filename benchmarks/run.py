@@ -0,0 +1,260 @@
+"""
+Load-test the backend against a fake WeatherAPI and the PostgreSQL database from `.env`.
+
+The runner seeds `weather_data` with a synthetic dataset, starts the fake upstream and
+the FastAPI app as uvicorn subprocesses, drives each endpoint at a fixed concurrency
+and writes latency percentiles, throughput and the app's peak RSS to a JSON file.
+
+Usage:
+    python -m benchmarks.run --rows 100000 --concurrency 32 --requests 2000
+    python -m benchmarks.run --rows 1000000 --skip-seed --compare bench_before.json
+
+The seed step truncates `weather_data`, so point DB_NAME at a scratch database.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+import httpx
+from backend.database import create_table_if_not_exists, get_connection, close_pool
+from backend.ingest import IteratorReader
+
+ENDPOINTS = ("get_weather", "read_records", "update_condition", "download_data")
+CITIES = 500
+SEED_BATCH_SIZE = 10000
+
+
+def seed_rows(rows):
+    started = datetime(2020, 1, 1)
+    for start in range(0, rows, SEED_BATCH_SIZE):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for i in range(start, min(start + SEED_BATCH_SIZE, rows)):
+            city = f"City{i % CITIES}"
+            writer.writerow([
+                city,
+                f"{city} Region",
+                "Benchmarkland",
+                random.choice(["Sunny", "Cloudy", "Light rain", "Mist"]),
+                round(random.uniform(-20, 40), 1),
+                round(random.uniform(0, 60), 1),
+                round(random.uniform(0, 20), 1),
+                (started + timedelta(minutes=i // CITIES)).strftime("%Y-%m-%d %H:%M:%S"),
+            ])
+        yield buffer.getvalue()
+
+
+def seed(rows):
+    create_table_if_not_exists()
+    started = time.perf_counter()
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("TRUNCATE weather_data RESTART IDENTITY;")
+        cursor.execute("SET LOCAL weather.skip_changes = 'on';")
+        cursor.copy_expert(
+            "COPY weather_data (location, region, country, condition, temperature_c, wind_speed_kph, precipitation_mm, date) "
+            "FROM STDIN WITH (FORMAT csv)",
+            IteratorReader(seed_rows(rows)),
+        )
+        connection.commit()
+        cursor.execute("ANALYZE weather_data;")
+        connection.commit()
+        cursor.close()
+    close_pool()
+    return time.perf_counter() - started
+
+
+def start_server(app, port, env):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env},
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{app} exited with code {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/openapi.json", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{app} did not start on port {port}")
+
+
+def peak_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def build_request(endpoint, args):
+    if endpoint == "get_weather":
+        params = {"location": f"City{random.randrange(CITIES)}"}
+        if args.weather_fresh:
+            params["fresh"] = "true"
+        return "GET", "/get_weather/", params
+    if endpoint == "read_records":
+        return "GET", "/read_records/", {"limit": args.page_size, "shape": args.read_shape}
+    if endpoint == "update_condition":
+        return "PUT", f"/update_condition/{random.randint(1, max(args.rows, 1))}", {"condition": random.choice(["Sunny", "Cloudy"])}
+    return "GET", "/download_data/", {"format": args.download_format}
+
+
+async def drive(client, endpoint, requests, concurrency, args):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, path, params = build_request(endpoint, args)
+            started = time.perf_counter()
+            try:
+                async with client.stream(method, path, params=params) as response:
+                    async for _ in response.aiter_raw():
+                        pass
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "max_ms": round(max(latencies), 2) if latencies else None,
+    }
+
+
+async def run_load(args, port):
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=300) as client:
+        for endpoint in args.endpoints:
+            requests = args.download_requests if endpoint == "download_data" else args.requests
+            concurrency = min(args.concurrency, requests)
+            # Warm up caches and connection pools so they don't skew the first percentiles.
+            await drive(client, endpoint, min(args.warmup, requests), concurrency, args)
+            results[endpoint] = await drive(client, endpoint, requests, concurrency, args)
+            print(f"{endpoint:>17}: {json.dumps(results[endpoint])}")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit')}):")
+    for endpoint, result in current["results"].items():
+        before = baseline.get("results", {}).get(endpoint)
+        if not before:
+            continue
+        deltas = []
+        for metric in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            if before.get(metric) and result.get(metric) is not None:
+                change = (result[metric] - before[metric]) / before[metric] * 100
+                deltas.append(f"{metric} {before[metric]} -> {result[metric]} ({change:+.1f}%)")
+        print(f"{endpoint:>17}: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the weather backend endpoints.")
+    parser.add_argument("--rows", type=int, default=10000, help="rows to seed into weather_data (1k to 10M)")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the rows already in the database")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per endpoint")
+    parser.add_argument("--download-requests", type=int, default=5, help="requests for /download_data/")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per endpoint")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--page-size", type=int, default=100, help="limit passed to /read_records/")
+    parser.add_argument("--read-shape", default="records", help="shape passed to /read_records/")
+    parser.add_argument("--download-format", default="csv")
+    parser.add_argument("--weather-fresh", action="store_true", help="bypass the weather cache")
+    parser.add_argument("--upstream-latency-ms", type=float, default=50)
+    parser.add_argument("--upstream-error-rate", type=float, default=0)
+    parser.add_argument("--app-port", type=int, default=8001)
+    parser.add_argument("--upstream-port", type=int, default=8002)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="previous output file to compare against")
+    args = parser.parse_args()
+
+    seed_s = None
+    if not args.skip_seed:
+        print(f"Seeding {args.rows} rows...")
+        seed_s = round(seed(args.rows), 2)
+
+    upstream = start_server("benchmarks.fake_weatherapi:app", args.upstream_port, {
+        "FAKE_LATENCY_MS": str(args.upstream_latency_ms),
+        "FAKE_ERROR_RATE": str(args.upstream_error_rate),
+    })
+    app = None
+    try:
+        app = start_server("backend.app:app", args.app_port, {
+            "WEATHER_API_URL": f"http://127.0.0.1:{args.upstream_port}/v1/current.json",
+            "YOUTUBE_API_URL": f"http://127.0.0.1:{args.upstream_port}/youtube/v3/search",
+            "WEATHER_API_KEY": "benchmark",
+        })
+        results = asyncio.run(run_load(args, args.app_port))
+        rss = peak_rss_mb(app.pid)
+    finally:
+        for process in (app, upstream):
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    output = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "seed_s": seed_s,
+        "peak_rss_mb": rss,
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=2)
+    print(f"Peak RSS: {rss} MB. Results written to {args.output}")
+
+    if args.compare:
+        compare(output, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Measure backend cold start: module import time and time until a new uvicorn worker
+answers its first request (lifespan included: schema check, pool warm-up).
+
+Every sample runs in a fresh interpreter. The slowest top-level imports reported by
+`python -X importtime` are listed to show where import time goes.
+
+Usage:
+    python -m benchmarks.startup --runs 10 --output startup_before.json
+    python -m benchmarks.startup --runs 10 --compare startup_before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+import httpx
+from benchmarks.run import git_commit
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import backend.app; "
+    "print((time.perf_counter() - started) * 1000)"
+)
+
+
+def import_ms():
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET], text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(limit):
+    """
+    Return the `limit` top-level modules imported by backend.app with the highest cumulative time.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.app"],
+        capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name[1:]
+        # Direct imports of backend.app are indented by exactly two spaces.
+        if name.startswith("   ") or not name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        modules.append((name.strip(), int(cumulative) / 1000))
+    modules.sort(key=lambda module: module[1], reverse=True)
+    return [{"module": name, "cumulative_ms": round(ms, 1)} for name, ms in modules[:limit]]
+
+
+def first_response_ms(port):
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.app:app", "--port", str(port), "--log-level", "warning"],
+        env=os.environ.copy(),
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"backend.app exited with code {process.returncode}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                    return (time.perf_counter() - started) * 1000
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"backend.app did not start on port {port}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summarize(samples):
+    return {
+        "runs": len(samples),
+        "min_ms": round(min(samples), 1),
+        "median_ms": round(statistics.median(samples), 1),
+        "max_ms": round(max(samples), 1),
+    }
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit')}):")
+    for key, result in current["results"].items():
+        before = baseline.get("results", {}).get(key, {}).get("median_ms")
+        after = result["median_ms"]
+        if before:
+            print(f"{key:>15}: median {before} -> {after} ms ({(after - before) / before * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend import and startup time.")
+    parser.add_argument("--runs", type=int, default=10, help="fresh processes per measurement")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to report")
+    parser.add_argument("--skip-server", action="store_true", help="only measure import time")
+    parser.add_argument("--app-port", type=int, default=8001)
+    parser.add_argument("--output", default="startup_output.json")
+    parser.add_argument("--compare", help="previous output file to compare against")
+    args = parser.parse_args()
+
+    results = {"import": summarize([import_ms() for _ in range(args.runs)])}
+    print(f"{'import':>15}: {json.dumps(results['import'])}")
+    if not args.skip_server:
+        results["first_response"] = summarize([first_response_ms(args.app_port) for _ in range(args.runs)])
+        print(f"{'first_response':>15}: {json.dumps(results['first_response'])}")
+
+    output = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {"runs": args.runs},
+        "results": results,
+        "slowest_imports": slowest_imports(args.top),
+    }
+    for module in output["slowest_imports"]:
+        print(f"{module['module']:>30}: {module['cumulative_ms']} ms")
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(output, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 from datetime import datetime
 from dotenv import load_dotenv
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
 import os
+from urllib.parse import urlencode
 
 load_dotenv()
 
@@ -14,25 +19,139 @@ st.set_page_config(
 )
 
 API_URL = "http://127.0.0.1:8000"  
-YOUTUBE_API_KEY = os.getenv("YT_API_KEY")
-YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3/search"
-
-
-def fetch_youtube_videos(query):
-    try:
-        params = {
-            "part": "snippet",
-            "q": query + ' weather',
-            "type": "video",
-            "key": YOUTUBE_API_KEY,
-            "maxResults": 5,
-        }
-        response = requests.get(YOUTUBE_API_URL, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json().get("items", [])
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error fetching YouTube videos: {e}")
-        return []
+CACHE_TTL = float(os.getenv("FRONTEND_CACHE_TTL", "300"))
+CACHE_SIZE = int(os.getenv("FRONTEND_CACHE_SIZE", "256"))
+PAGE_SIZE_OPTIONS = [25, 50, 100]
+SORT_LABELS = {"-date": "Newest first", "date": "Oldest first", "-id": "Latest added", "id": "First added"}
+
+
+class TTLCache:
+    """
+    Small thread-safe cache shared by all sessions of this Streamlit server.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self._data.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.max_size:
+                self._data.pop(min(self._data, key=lambda k: self._data[k][0]))
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=8)
+
+
+@st.cache_resource
+def get_cache():
+    return TTLCache(CACHE_TTL, CACHE_SIZE)
+
+
+def normalize_location(location):
+    return " ".join(location.split()).lower()
+
+
+def fetch_weather(session, location):
+    response = session.get(f"{API_URL}/get_weather/", params={"location": location}, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_youtube_videos(session, query):
+    response = session.get(f"{API_URL}/youtube_videos/", params={"query": query}, timeout=20)
+    response.raise_for_status()
+    return response.json().get("items", [])
+
+
+def fetch_history_page(session, filters, cursor=None):
+    """
+    Fetch one page of records; returns the records and the cursor for the next page.
+    """
+    params = dict(filters)
+    if cursor:
+        params["cursor"] = cursor
+    response = session.get(f"{API_URL}/read_records/", params=params, timeout=10)
+    response.raise_for_status()
+    return response.json(), response.headers.get("X-Next-Cursor")
+
+
+def fetch_changes(session, cursor=None):
+    """
+    Fetch record changes after `cursor` from the change feed; returns the events and the new cursor.
+    Without a cursor, returns no events and the current end of the feed.
+    """
+    params = {"cursor": cursor} if cursor else {}
+    response = session.get(f"{API_URL}/changes/", params=params, timeout=10)
+    response.raise_for_status()
+    data = response.json()
+    return data["events"], data["cursor"]
+
+
+def apply_changes(page, events):
+    """
+    Apply change feed events to a loaded history page in place.
+
+    Updates and deletes of records on the page are patched locally; inserts are
+    only counted, since where they belong depends on the sort order. Returns
+    False if the page has to be reloaded instead.
+    """
+    by_id = page["by_id"]
+    for event in events:
+        if event["op"] in ("truncate", "reset"):
+            return False
+        if event["op"] == "insert":
+            page["new_records"] += 1
+        elif event["id"] in by_id:
+            if event["op"] == "delete":
+                del by_id[event["id"]]
+            else:
+                by_id[event["id"]] = event["record"]
+    page["records"] = [by_id[record["id"]] for record in page["records"] if record["id"] in by_id]
+    return True
+
+
+def fetch_cached(kind, location, fetch):
+    """
+    Return a future for `fetch(session, location)`, served from the shared cache when possible.
+    """
+    cache = get_cache()
+    key = (kind, normalize_location(location))
+    cached = cache.get(key)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    def store(done):
+        if done.exception() is None:
+            cache.set(key, done.result())
+
+    future = get_executor().submit(fetch, get_session(), location)
+    future.add_done_callback(store)
+    return future
 
 def get_weather_emoji(condition):
     condition = condition.lower() if condition else ""
@@ -81,10 +200,12 @@ if section == "Current Weather":
 
     if search_button and location:
         try:
+            # Weather and YouTube results are fetched concurrently and cached per location.
+            weather_future = fetch_cached("weather", location, fetch_weather)
+            videos_future = fetch_cached("youtube", location, fetch_youtube_videos)
+
             with st.spinner(f"Fetching weather data for {location}..."):
-                response = requests.get(f"{API_URL}/get_weather/", params={"location": location}, timeout=10)
-                response.raise_for_status()
-                weather_data = response.json()
+                weather_data = weather_future.result()
 
                 col1, col2 = st.columns([2, 1])
 
@@ -113,7 +234,11 @@ if section == "Current Weather":
                         st.metric("Wind Speed", f"{weather_data.get('wind_speed_kph', 'N/A')} km/h")
 
             with st.spinner(f"Searching YouTube videos about {location}..."):
-                videos = fetch_youtube_videos(location)
+                try:
+                    videos = videos_future.result()
+                except requests.exceptions.RequestException as e:
+                    st.error(f"Error fetching YouTube videos: {e}")
+                    videos = []
                 if videos:
                     st.markdown("### Related YouTube Videos")
                     video_columns = st.columns(2) 
@@ -160,90 +285,175 @@ elif section == "Search History":
     with col1:
         st.subheader("Previous Weather Searches")
 
-    try:
-        with st.spinner("Loading search history..."):
-            response = requests.get(f"{API_URL}/read_records/", timeout=10)
-            response.raise_for_status()
-            records = response.json()
-
-            if records:
-                df = pd.DataFrame(records)
+    filter_cols = st.columns([3, 3, 2, 2, 2, 1])
+    with filter_cols[0]:
+        location_filter = st.text_input("Location", placeholder="e.g., London").strip()
+    with filter_cols[1]:
+        country_filter = st.text_input("Country", placeholder="e.g., United Kingdom").strip()
+    with filter_cols[2]:
+        start_date = st.date_input("From", value=None)
+    with filter_cols[3]:
+        end_date = st.date_input("To", value=None)
+    with filter_cols[4]:
+        sort = st.selectbox("Sort", list(SORT_LABELS), format_func=SORT_LABELS.get)
+    with filter_cols[5]:
+        page_size = st.selectbox("Rows", PAGE_SIZE_OPTIONS)
+
+    filters = {
+        "location": location_filter or None,
+        "country": country_filter or None,
+        "start_date": f"{start_date}T00:00:00" if start_date else None,
+        "end_date": f"{end_date}T23:59:59" if end_date else None,
+        "sort": sort,
+        "limit": page_size,
+    }
+    filters = {key: value for key, value in filters.items() if value is not None}
+
+    state = st.session_state
+    if state.get("history_filters") != filters:
+        state.history_filters = filters
+        state.history_cursors = [None]
+        state.history_page_index = 0
+        state.history_page = None
 
-                if 'timestamp' in df.columns:
-                    df['timestamp'] = pd.to_datetime(df['timestamp']).dt.strftime('%Y-%m-%d %H:%M')
-
-                st.dataframe(
-                    df,
-                    use_container_width=True
+    try:
+        if state.history_page is not None:
+            # Keep the loaded page current with the changes made since, instead of re-reading it.
+            try:
+                events, feed_cursor = fetch_changes(get_session(), state.history_page["feed_cursor"])
+                state.history_page["feed_cursor"] = feed_cursor
+                if not apply_changes(state.history_page, events):
+                    state.history_page = None
+            except requests.exceptions.HTTPError:
+                state.history_page = None
+
+        if state.history_page is None:
+            with st.spinner("Loading search history..."):
+                # Take the feed position before the page so no change in between is missed.
+                _, feed_cursor = fetch_changes(get_session())
+                cursor = state.history_cursors[state.history_page_index]
+                records, next_cursor = fetch_history_page(get_session(), filters, cursor)
+                state.history_page = {
+                    "records": records,
+                    "next_cursor": next_cursor,
+                    "by_id": {record["id"]: record for record in records},
+                    "feed_cursor": feed_cursor,
+                    "new_records": 0,
+                }
+
+        page = state.history_page
+        records = page["records"]
+        records_by_id = page["by_id"]
+
+        if records:
+            df = pd.DataFrame(records)
+
+            if 'timestamp' in df.columns:
+                df['timestamp'] = pd.to_datetime(df['timestamp']).dt.strftime('%Y-%m-%d %H:%M')
+
+            st.dataframe(
+                df,
+                use_container_width=True
+            )
+
+            if page["new_records"]:
+                refresh_cols = st.columns([5, 1])
+                with refresh_cols[0]:
+                    st.caption(f"{page['new_records']} new record(s) added since this page was loaded.")
+                with refresh_cols[1]:
+                    if st.button("Refresh", use_container_width=True):
+                        state.history_page = None
+                        st.rerun()
+
+            nav_cols = st.columns([1, 4, 1])
+            with nav_cols[0]:
+                if st.button("◀ Previous", disabled=state.history_page_index == 0, use_container_width=True):
+                    state.history_page_index -= 1
+                    state.history_page = None
+                    st.rerun()
+            with nav_cols[1]:
+                st.caption(f"Page {state.history_page_index + 1}")
+            with nav_cols[2]:
+                if st.button("Next ▶", disabled=not page["next_cursor"], use_container_width=True):
+                    del state.history_cursors[state.history_page_index + 1:]
+                    state.history_cursors.append(page["next_cursor"])
+                    state.history_page_index += 1
+                    state.history_page = None
+                    st.rerun()
+
+            st.markdown("---")
+            st.markdown("### Manage Records")
+            col1, col2, col3, col4 = st.columns([3, 2, 2, 3])
+
+            with col1:
+                action = st.radio("Action:", ["Edit", "Delete"], horizontal=True, label_visibility="collapsed")
+
+            with col2:
+                selected_record = st.selectbox(
+                    "Select Record:",
+                    options=list(records_by_id),
+                    format_func=lambda x: f"#{x} - {records_by_id[x]['location']}"
                 )
 
-                st.markdown("---")
-                st.markdown("### Manage Records")
-                col1, col2, col3, col4 = st.columns([3, 2, 2, 3])
-
-                with col1:
-                    action = st.radio("Action:", ["Edit", "Delete"], horizontal=True, label_visibility="collapsed")
-
-                with col2:
-                    if not df.empty:
-                        selected_record = st.selectbox(
-                            "Select Record:",
-                            options=df['id'].tolist(),
-                            format_func=lambda x: f"#{x} - {df[df['id'] == x]['location'].values[0]}"
-                        )
-
-                with col4:
-                    if action == "Delete" and selected_record:
-                        if st.button("Delete", key="delete_button", use_container_width=True):
-                            try:
-                                delete_response = requests.get(f"{API_URL}/delete_record/", params={"record_id": selected_record}, timeout=10)
-                                delete_response.raise_for_status()
-                                st.success(f"Record #{selected_record} deleted.")
-                                st.rerun()
-                            except requests.exceptions.RequestException as e:
-                                st.error(f"Error deleting record: {e}")
-
-                    elif action == "Edit" and selected_record:
-                        selected_row = df[df['id'] == selected_record]
-                        current_condition = selected_row['condition'].values[0] if len(selected_row) > 0 else ""
-                        new_condition = st.text_input("New Condition:", value=current_condition, key="condition_input")
-
-                        if st.button("Update", key="update_button", use_container_width=True):
-                            try:
-                                update_response = requests.put(
-                                    f"{API_URL}/update_condition/{selected_record}",
-                                    params={"condition": new_condition},
-                                    timeout=10
-                                )
-                                update_response.raise_for_status()
-                                st.success(f"Record updated.")
-                                st.rerun()
-                            except requests.exceptions.RequestException as e:
-                                st.error(f"Error updating record: {e}")
-
-                st.markdown("---")
-                st.markdown("### Export Data")
-
-                col1, col3 = st.columns([6, 3])
-
-                with col1:
-                    st.write("Export your search history data in different formats.")
-
-                with col3:
-                    export_format = st.selectbox("Format:", ["JSON", "CSV"], label_visibility="collapsed")                
-                    if st.button("Export", key="export_btn", use_container_width=True):
+            with col4:
+                if action == "Delete" and selected_record:
+                    if st.button("Delete", key="delete_button", use_container_width=True):
                         try:
-                            format_param = export_format.lower()
-                            download_url = f"{API_URL}/download_data/?format={format_param}"
-                            st.markdown(f"""
-                                <a href="{download_url}" target="_blank">
-                                    <button>Download {export_format}</button>
-                                </a>
-                            """, unsafe_allow_html=True)
-                        except Exception as e:
-                            st.error(f"Error exporting data: {e}")
-            else:
-                st.info("No search history found.")
+                            delete_response = get_session().get(f"{API_URL}/delete_record/", params={"record_id": selected_record}, timeout=10)
+                            delete_response.raise_for_status()
+                            st.success(f"Record #{selected_record} deleted.")
+                            st.rerun()
+                        except requests.exceptions.RequestException as e:
+                            st.error(f"Error deleting record: {e}")
+
+                elif action == "Edit" and selected_record:
+                    current_condition = records_by_id[selected_record]['condition'] or ""
+                    new_condition = st.text_input("New Condition:", value=current_condition, key="condition_input")
+
+                    if st.button("Update", key="update_button", use_container_width=True):
+                        try:
+                            update_response = get_session().put(
+                                f"{API_URL}/update_condition/{selected_record}",
+                                params={"condition": new_condition},
+                                timeout=10
+                            )
+                            update_response.raise_for_status()
+                            st.success(f"Record updated.")
+                            st.rerun()
+                        except requests.exceptions.RequestException as e:
+                            st.error(f"Error updating record: {e}")
+
+            st.markdown("---")
+            st.markdown("### Export Data")
+
+            col1, col3 = st.columns([6, 3])
+
+            with col1:
+                st.write("Export your search history data in different formats. Exports use the filters above.")
+
+            with col3:
+                export_format = st.selectbox("Format:", ["JSON", "CSV", "Parquet"], label_visibility="collapsed")
+                if st.button("Export", key="export_btn", use_container_width=True):
+                    try:
+                        export_params = {key: value for key, value in filters.items() if key not in ("sort", "limit")}
+                        export_params["format"] = export_format.lower()
+                        download_url = f"{API_URL}/download_data/?{urlencode(export_params)}"
+                        st.markdown(f"""
+                            <a href="{download_url}" target="_blank">
+                                <button>Download {export_format}</button>
+                            </a>
+                        """, unsafe_allow_html=True)
+                    except Exception as e:
+                        st.error(f"Error exporting data: {e}")
+        elif state.history_page_index > 0:
+            st.info("No more records on this page.")
+            if st.button("◀ Back to first page"):
+                state.history_cursors = [None]
+                state.history_page_index = 0
+                state.history_page = None
+                st.rerun()
+        else:
+            st.info("No search history found.")
     except requests.exceptions.Timeout:
         st.error("The request timed out while loading search history. Please try again.")
     except requests.exceptions.ConnectionError:
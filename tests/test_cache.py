@@ -0,0 +1,106 @@
+import asyncio
+import time
+import pytest
+from backend.cache import ExportCache, TTLCache
+
+
+def test_get_set_and_expiry():
+    cache = TTLCache(ttl=0.05, max_size=10)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_lru_eviction():
+    cache = TTLCache(ttl=60, max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_remaining():
+    cache = TTLCache(ttl=60, max_size=10)
+    assert cache.ttl_remaining("a") is None
+    cache.set("a", 1)
+    assert 59 < cache.ttl_remaining("a") <= 60
+    assert cache.stats()["hits"] == 0
+
+
+def test_discard():
+    cache = TTLCache(ttl=60, max_size=10)
+    cache.set("a", 1)
+    cache.discard("a")
+    cache.discard("missing")
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(ttl=60, max_size=10)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_load("k", loader) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert calls == 1
+    assert cache.stats()["coalesced"] == 4
+    assert cache.get("k") == "value"
+
+
+def test_loader_errors_are_not_cached():
+    cache = TTLCache(ttl=60, max_size=10)
+    results = iter([RuntimeError("upstream down"), "value"])
+
+    async def loader():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.aget_or_load("k", loader))
+    assert cache.get("k") is None
+    assert asyncio.run(cache.aget_or_load("k", loader)) == "value"
+
+
+def test_bypass_always_loads_and_refreshes():
+    cache = TTLCache(ttl=60, max_size=10)
+    cache.set("k", "old")
+
+    async def loader():
+        return "new"
+
+    assert asyncio.run(cache.aget_or_load("k", loader, bypass=True)) == "new"
+    assert cache.get("k") == "new"
+    assert cache.stats()["bypassed"] == 1
+
+
+def test_export_cache_serves_only_the_current_version():
+    cache = ExportCache(max_bytes=100, max_entry_bytes=50)
+    cache.set("csv", 1, b"abc", "text/csv", {})
+    assert cache.get("csv", 1) == (b"abc", "text/csv", {})
+    assert cache.get("csv", 2) is None
+
+
+def test_export_cache_byte_bound():
+    cache = ExportCache(max_bytes=10, max_entry_bytes=8)
+    cache.set("big", 1, b"x" * 9, "text/csv", {})
+    assert cache.stats()["too_large"] == 1
+    cache.set("a", 1, b"x" * 6, "text/csv", {})
+    cache.set("b", 1, b"x" * 6, "text/csv", {})
+    assert cache.get("a", 1) is None
+    assert cache.get("b", 1) is not None
+    assert cache.stats()["bytes"] == 6
@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from backend import changes
+from backend.changes import CursorExpired, format_cursor, parse_cursor
+
+
+def test_cursor_round_trip():
+    assert parse_cursor(format_cursor(123, 9223372036854775807)) == (123, 9223372036854775807)
+
+
+@pytest.mark.parametrize("cursor", [None, "", "12", "a:b", "1:2:3"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        parse_cursor(cursor)
+
+
+@pytest.fixture(autouse=True)
+def listener(monkeypatch):
+    # Each asyncio.run() has its own loop, so every test needs a fresh wake-up event.
+    monkeypatch.setattr(changes, "listener", changes.ChangeListener(None))
+
+
+async def collect(stream):
+    return [message async for message in stream]
+
+
+def test_stream_sends_the_cursor_before_any_event(monkeypatch):
+    monkeypatch.setattr(changes, "read_changes", lambda cursor: ([], cursor))
+    monkeypatch.setattr(changes, "CHANGE_FEED_HEARTBEAT", 0.01)
+    monkeypatch.setattr(changes, "CHANGE_FEED_MAX_STREAM_SECONDS", 0.05)
+    messages = asyncio.run(collect(changes.stream_changes("5:7")))
+    assert messages[0] == "retry: 1000\nid: 5:7\n\n"
+    keep_alives = [message for message in messages if "keep-alive" in message]
+    assert keep_alives and all(message.startswith("id: 5:7\n") for message in keep_alives)
+
+
+def test_stream_event_ids_advance_the_cursor(monkeypatch):
+    batches = iter([
+        ([{"cursor": "6:1", "op": "insert", "id": 1, "record": {"id": 1}, "changed_at": None}], "6:1"),
+    ])
+    monkeypatch.setattr(changes, "read_changes", lambda cursor: next(batches, ([], cursor)))
+    monkeypatch.setattr(changes, "CHANGE_FEED_HEARTBEAT", 0.01)
+    monkeypatch.setattr(changes, "CHANGE_FEED_MAX_STREAM_SECONDS", 0.05)
+    messages = asyncio.run(collect(changes.stream_changes("5:7")))
+    assert messages[1].startswith("id: 6:1\ndata: ")
+    assert all(message.startswith("id: 6:1\n") for message in messages if "keep-alive" in message)
+
+
+def test_stream_sends_reset_for_an_expired_cursor(monkeypatch):
+    def expired(cursor):
+        raise CursorExpired("gone")
+
+    monkeypatch.setattr(changes, "read_changes", expired)
+    messages = asyncio.run(collect(changes.stream_changes("5:7")))
+    assert messages[-1].startswith("event: reset\n")
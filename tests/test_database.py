@@ -0,0 +1,135 @@
+from contextlib import contextmanager
+from datetime import datetime
+import pytest
+from backend import database
+from backend.database import COLUMNS, decode_cursor, encode_cursor, etag_matches, make_etag, shape_rows
+
+
+def row(id, date):
+    return (id, "London", "City of London", "UK", "Sunny", 12.0, 5.0, 0.0, date)
+
+
+class FakeCursor:
+    def __init__(self, rows, queries):
+        self.rows = rows
+        self.queries = queries
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows, queries):
+        self.rows = rows
+        self.queries = queries
+
+    def cursor(self):
+        return FakeCursor(self.rows, self.queries)
+
+    def commit(self):
+        pass
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    state = {"rows": [], "queries": []}
+
+    @contextmanager
+    def get_connection():
+        yield FakeConnection(state["rows"], state["queries"])
+
+    monkeypatch.setattr(database, "get_connection", get_connection)
+    return state
+
+
+@pytest.mark.parametrize("sort", ["id", "-id", "date", "-date"])
+def test_cursor_round_trip(sort):
+    date = datetime(2024, 1, 2, 3, 4, 5)
+    key = date if sort.lstrip("-") == "date" else None
+    assert decode_cursor(encode_cursor(sort, row(7, date))) == (sort, key, 7)
+
+
+def test_cursor_for_a_row_without_a_date():
+    assert decode_cursor(encode_cursor("date", row(7, None))) == ("date", None, 7)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "WzFd"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_read_returns_next_cursor_when_more_rows(fake_db):
+    fake_db["rows"][:] = [row(1, None), row(2, None), row(3, None)]
+    rows, cursor = database.read(limit=2)
+    assert [r[0] for r in rows] == [1, 2]
+    assert decode_cursor(cursor) == ("id", None, 2)
+    query, params = fake_db["queries"][-1]
+    assert "ORDER BY id ASC" in query
+    assert params[-1] == 3
+
+
+def test_read_last_page_has_no_cursor(fake_db):
+    fake_db["rows"][:] = [row(1, None)]
+    assert database.read(limit=2)[1] is None
+
+
+def test_read_rejects_cursor_from_another_sort(fake_db):
+    with pytest.raises(ValueError):
+        database.read(cursor=encode_cursor("id", row(1, None)), sort="date")
+
+
+@pytest.mark.parametrize("sort, condition", [
+    ("date", "((date, id) > (%s, %s) OR date IS NULL)"),
+    ("-date", "((date, id) < (%s, %s))"),
+])
+def test_date_keyset_after_a_dated_row(fake_db, sort, condition):
+    date = datetime(2024, 1, 2)
+    database.read(cursor=encode_cursor(sort, row(5, date)), sort=sort)
+    query, params = fake_db["queries"][-1]
+    assert condition in query
+    assert params[:2] == [date, 5]
+
+
+@pytest.mark.parametrize("sort, condition", [
+    ("date", "(date IS NULL AND id > %s)"),
+    ("-date", "(date IS NULL AND id < %s OR date IS NOT NULL)"),
+])
+def test_date_keyset_after_a_row_without_a_date(fake_db, sort, condition):
+    database.read(cursor=encode_cursor(sort, row(5, None)), sort=sort)
+    query, params = fake_db["queries"][-1]
+    assert condition in query
+    assert params[0] == 5
+
+
+def test_date_page_ending_without_a_date(fake_db):
+    fake_db["rows"][:] = [row(1, datetime(2024, 1, 1)), row(2, None), row(3, None)]
+    _, cursor = database.read(limit=2, sort="date")
+    assert decode_cursor(cursor) == ("date", None, 2)
+
+
+def test_shape_rows():
+    rows = [row(1, None), row(2, None)]
+    assert shape_rows(rows, "rows") == {"columns": COLUMNS, "rows": rows}
+    columns = shape_rows(rows, "columns")
+    assert columns["id"] == (1, 2)
+    assert set(columns) == set(COLUMNS)
+    assert shape_rows([], "columns")["id"] == ()
+
+
+def test_etags():
+    etag = make_etag(3, "csv", None)
+    assert etag.startswith('"3-')
+    assert etag != make_etag(4, "csv", None)
+    assert etag != make_etag(3, "json", None)
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
@@ -0,0 +1,98 @@
+import asyncio
+from fastapi import HTTPException
+from backend.cache import TTLCache
+from backend.prefetch import PrefetchScheduler
+
+
+def make_scheduler(cache=None, refresh=None, history=None, **kwargs):
+    async def default_refresh(key):
+        return {"location": key}
+
+    options = {"top_n": 10, "interval": 60, "lead": 15, "rate": 0}
+    options.update(kwargs)
+    return PrefetchScheduler(
+        cache or TTLCache(60, 100),
+        refresh or default_refresh,
+        history or (lambda days, limit: []),
+        **options,
+    )
+
+
+def running(scheduler):
+    # track() only counts requests while the scheduler runs; fake a started task.
+    scheduler._task = object()
+    return scheduler
+
+
+def test_track_is_ignored_while_stopped():
+    scheduler = make_scheduler()
+    scheduler.track("london")
+    assert scheduler.stats()["tracked"] == 0
+
+
+def test_hot_locations_rank_by_requests():
+    scheduler = running(make_scheduler(top_n=2))
+    for key, count in (("paris", 1), ("london", 3), ("tokyo", 2)):
+        for _ in range(count):
+            scheduler.track(key)
+    assert scheduler.hot_locations() == ["london", "tokyo"]
+
+
+def test_history_only_ranks_requested_locations():
+    history = lambda days, limit: [("Paris", 90), ("London", 10), ("Tokyo", 1000)]
+    scheduler = running(make_scheduler(history=history))
+    scheduler.track("london")
+    scheduler.track("paris")
+    asyncio.run(scheduler._load_history())
+    # Tokyo is stored most often but nobody is asking for it any more.
+    assert scheduler.hot_locations() == ["paris", "london"]
+
+
+def test_locations_below_min_score_are_not_prefetched():
+    scheduler = running(make_scheduler(decay=0.5, min_score=0.5))
+    scheduler.track("london")
+    scheduler._decay()
+    assert scheduler.hot_locations() == ["london"]
+    scheduler._decay()
+    assert scheduler.hot_locations() == []
+
+
+def test_decay_drops_cold_keys_and_caps_tracking():
+    scheduler = running(make_scheduler(decay=0.05, max_tracked=2))
+    for key in ("a", "b", "c"):
+        scheduler.track(key)
+    for _ in range(10):
+        scheduler.track("a")
+    scheduler._decay()
+    assert len(scheduler._scores) == 2 and "a" in scheduler._scores
+    scheduler._decay()
+    assert list(scheduler._scores) == ["a"]
+
+
+def test_run_once_refreshes_only_missing_or_expiring_entries():
+    cache = TTLCache(60, 100)
+    cache.set("fresh", {"location": "fresh"})
+    refreshed = []
+
+    async def refresh(key):
+        refreshed.append(key)
+        return {"location": key}
+
+    scheduler = running(make_scheduler(cache=cache, refresh=refresh))
+    scheduler.track("fresh")
+    scheduler.track("cold")
+    asyncio.run(scheduler.run_once())
+    assert refreshed == ["cold"]
+    assert cache.get("cold") == {"location": "cold"}
+    assert scheduler.stats()["skipped_fresh"] == 1
+
+
+def test_unknown_locations_are_forgotten():
+    async def refresh(key):
+        raise HTTPException(status_code=404, detail="not found")
+
+    scheduler = running(make_scheduler(refresh=refresh))
+    scheduler.track("atlantis")
+    asyncio.run(scheduler.run_once())
+    assert scheduler.stats()["failed"] == 1
+    assert scheduler.hot_locations() == []
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from backend.write_behind import WriteBehindQueue
+
+
+class FakeStore:
+    """
+    Stand-in for save_many_to_db: fails the first `failures` calls (returning None,
+    like the real function after logging an error) and records saved records.
+    The first call waits for `block` when given.
+    """
+
+    def __init__(self, failures=0, block=None):
+        self.failures = failures
+        self.block = block
+        self.saved = []
+        self.calls = 0
+
+    def __call__(self, records):
+        self.calls += 1
+        if self.block is not None and self.calls == 1:
+            self.block.wait()
+        if self.failures > 0:
+            self.failures -= 1
+            return None
+        self.saved.extend(records)
+        return {"inserted": len(records)}
+
+
+def make_queue(store, **kwargs):
+    options = {"max_size": 100, "batch_size": 10, "flush_interval": 0.01, "put_timeout": 1,
+               "retry_delay": 0.01, "max_retry_delay": 0.02, "stop_timeout": 2}
+    options.update(kwargs)
+    return WriteBehindQueue(store, **options)
+
+
+def test_batches_and_flushes_on_stop():
+    store = FakeStore()
+    queue = make_queue(store)
+
+    async def main():
+        await queue.start()
+        for i in range(25):
+            await queue.put(i)
+        await queue.stop()
+
+    asyncio.run(main())
+    assert sorted(store.saved) == list(range(25))
+    assert queue.stats()["flushed_rows"] == 25
+    assert queue.stats()["failed_rows"] == 0
+
+
+def test_failed_flush_is_retried_not_dropped():
+    store = FakeStore(failures=3)
+    queue = make_queue(store)
+
+    async def main():
+        await queue.start()
+        for i in range(5):
+            await queue.put(i)
+        await queue.stop()
+
+    asyncio.run(main())
+    stats = queue.stats()
+    assert sorted(store.saved) == list(range(5))
+    assert stats["failed_flushes"] == 3
+    assert stats["failed_rows"] == 0
+
+
+def test_stop_saves_leftovers_when_flushes_keep_failing():
+    store = FakeStore(failures=1000)
+    queue = make_queue(store, stop_timeout=0.1)
+
+    async def main():
+        await queue.start()
+        for i in range(5):
+            await queue.put(i)
+        await queue.stop()
+
+    asyncio.run(main())
+    assert store.saved == []
+    assert queue.stats()["failed_rows"] == 5
+
+
+def test_full_queue_saves_synchronously():
+    release = threading.Event()
+    store = FakeStore(block=release)
+    queue = make_queue(store, max_size=1, batch_size=1, put_timeout=0.01)
+
+    async def main():
+        await queue.start()
+        await queue.put(1)
+        await asyncio.sleep(0.05)  # the drain task is now blocked saving record 1
+        await queue.put(2)
+        await queue.put(3)
+        release.set()
+        await queue.stop()
+
+    asyncio.run(main())
+    assert sorted(store.saved) == [1, 2, 3]
+    assert queue.stats()["overflow_saves"] == 1
+
+
+def test_stop_while_collecting_a_batch_saves_it():
+    store = FakeStore()
+    queue = make_queue(store, flush_interval=5, stop_timeout=0.2)
+
+    async def main():
+        await queue.start()
+        for i in range(3):
+            await queue.put(i)
+        await asyncio.sleep(0.05)  # the drain task has dequeued them and waits for more
+        await queue.stop()
+
+    asyncio.run(main())
+    assert sorted(store.saved) == [0, 1, 2]
+    assert queue.stats()["failed_rows"] == 0
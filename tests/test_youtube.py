@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime, timezone
+import pytest
+from fastapi import HTTPException
+from backend import youtube
+
+
+class FakeResponse:
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"items": [{"id": "a"}]}
+
+
+def fail(*args):
+    raise RuntimeError("database is down")
+
+
+@pytest.fixture
+def released(monkeypatch):
+    calls = []
+    monkeypatch.setattr(youtube, "release_lease", lambda key, quota_exceeded=False: calls.append(key))
+    return calls
+
+
+def test_unreadable_cache_is_an_http_error(monkeypatch, released):
+    monkeypatch.setattr(youtube, "read_cached", fail)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(youtube.load("london"))
+    assert e.value.status_code == 500
+
+
+def test_failed_claim_serves_stale_results(monkeypatch, released):
+    cached = ([{"id": "old"}], datetime(2026, 1, 1, tzinfo=timezone.utc), False)
+    monkeypatch.setattr(youtube, "read_cached", lambda key: cached)
+    monkeypatch.setattr(youtube, "claim_refresh", fail)
+    result = asyncio.run(youtube.load("london"))
+    assert result["stale"] and result["items"] == [{"id": "old"}]
+
+
+def test_failed_store_releases_the_lease_and_returns_the_results(monkeypatch, released):
+    monkeypatch.setattr(youtube, "read_cached", lambda key: None)
+    monkeypatch.setattr(youtube, "claim_refresh", lambda key: True)
+    monkeypatch.setattr(youtube, "store_results", fail)
+
+    async def search_upstream(key):
+        return FakeResponse()
+
+    monkeypatch.setattr(youtube, "search_upstream", search_upstream)
+    result = asyncio.run(youtube.load("london"))
+    assert result["items"] == [{"id": "a"}] and not result["stale"]
+    assert released == ["london"]